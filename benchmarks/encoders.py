@@ -0,0 +1,139 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from sem_scale_bar.core import image_kind, load_image, render_image
+from sem_scale_bar.encoders import get_encoder
+
+FIXTURES = "images for test"
+RENDER_ARGS = ("English", "white", "right", "", "left", False)
+
+TIFF_CASES = (
+    ("lzw", {}),
+    ("raw", {}),
+    ("deflate", {"level": 1}),
+    ("deflate", {"level": 6}),
+    ("deflate", {"level": 6, "threads": 1}),
+    ("zstd", {"level": 1}),
+    ("zstd", {"level": 5}),
+    ("zstd", {"level": 5, "threads": 1}),
+    ("zstd", {"level": 15}),
+)
+PNG_CASES = (
+    ("lzw", {}),  # Pillow defaults
+    ("lzw", {"png_level": 1}),
+    ("lzw", {"png_level": 9}),
+    ("lzw", {"png_level": 6, "png_strategy": "filtered"}),
+    ("lzw", {"png_level": 6, "png_strategy": "rle"}),
+    ("lzw", {"png_level": 6, "png_strategy": "huffman"}),
+)
+
+
+def describe(name, options, kind):
+    if kind == "png":
+        return "png " + (
+            " ".join(f"{key}={value}" for key, value in options.items()) or "default"
+        )
+    return " ".join([name] + [f"{key}={value}" for key, value in options.items()])
+
+
+def rendered_images(fixtures, sizes):
+    # the rendered fixtures, and larger frames tiled from the first one so that
+    # they keep the texture of real SEM images
+    images = []
+    for name in sorted(os.listdir(fixtures)):
+        path = os.path.join(fixtures, name)
+        if os.path.isfile(path) and image_kind(os.path.splitext(name)[1][1:]) == "tif":
+            with contextlib.redirect_stdout(io.StringIO()):
+                img, tags = load_image(path, "tif")
+                images.append((name, render_image(img, tags, *RENDER_ARGS)))
+    if images and sizes:
+        tile = np.asarray(images[0][1])
+        for width in sizes:
+            height = width * 3 // 4
+            reps = (-(-height // tile.shape[0]), -(-width // tile.shape[1]), 1)
+            frame = np.tile(tile, reps)[:height, :width]
+            images.append((f"tiled_{width}", Image.fromarray(frame)))
+    return images
+
+
+def best_time(encoder, image, path, kind, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encoder.save(image, path, kind)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare encode time and output size of the output encoders."
+    )
+    parser.add_argument(
+        "--fixtures",
+        default=FIXTURES,
+        help=f"Folder with real images (default: '{FIXTURES}')",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[4096],
+        help="Widths of larger frames tiled from the first test image",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    results = []
+    images = rendered_images(args.fixtures, args.sizes)
+    skipped = {}  # encoder name -> why it is not available, e.g. no imagecodecs
+    print(f"{'image':<14} {'encoder':<36} {'MB':>7} {'ratio':>6} {'s':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for image_name, image in images:
+            raw_bytes = np.asarray(image).nbytes
+            for kind, cases in (("tif", TIFF_CASES), ("png", PNG_CASES)):
+                for name, options in cases:
+                    if name in skipped:
+                        continue
+                    try:
+                        encoder = get_encoder(name, **options)
+                    except ValueError as error:
+                        skipped[name] = str(error)
+                        continue
+                    path = os.path.join(work_dir, f"out.{kind}")
+                    seconds = best_time(encoder, image, path, kind, args.repeat)
+                    size = os.path.getsize(path)
+                    label = describe(name, options, kind)
+                    results.append(
+                        {
+                            "image": image_name,
+                            "encoder": label,
+                            "bytes": size,
+                            "seconds": seconds,
+                        }
+                    )
+                    print(
+                        f"{image_name:<14} {label:<36} {size / 2**20:>7.2f} "
+                        f"{raw_bytes / size:>6.2f} {seconds:>8.3f}"
+                    )
+    for name, reason in skipped.items():
+        print(f"{name} cases skipped: {reason}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import png
+
+from sem_scale_bar.core import extract_png_chunks, png2np, read_png
+
+TESCAN_METADATA = b"[MAIN]\r\nPixelSizeX=1.2e-08\r\nImageStripSize=179\r\n"
+
+
+def write_tescan_png(path, width, height, bitdepth=16):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 2**bitdepth, (height, width), dtype=np.uint32)
+    buffer = io.BytesIO()
+    png.Writer(width, height, greyscale=True, bitdepth=bitdepth).write(
+        buffer, img.astype(np.uint16 if bitdepth == 16 else np.uint8)
+    )
+    chunks = list(png.Reader(bytes=buffer.getvalue()).chunks())
+    chunks.insert(1, (b"gIFx", TESCAN_METADATA))  # Tescan stores it after IHDR
+    with open(path, "wb") as file:
+        png.write_chunks(file, chunks)
+
+
+def two_pass(path):
+    return png2np(path), extract_png_chunks(path)
+
+
+def best_time(func, path, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare reading Tescan PNG exports with png2np + extract_png_chunks "
+            "against the single-pass read_png."
+        )
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1024, 2048, 4096],
+        help="Image widths to test; height is 3/4 of the width",
+    )
+    parser.add_argument(
+        "--bitdepth", type=int, choices=[8, 16], default=16, help="PNG bit depth"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    print(f"{'size':>11} {'MB':>7} {'two-pass s':>11} {'read_png s':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for width in args.sizes:
+            height = width * 3 // 4
+            path = os.path.join(work_dir, f"tescan_{width}.png")
+            write_tescan_png(path, width, height, args.bitdepth)
+            old = best_time(two_pass, path, args.repeat)
+            new = best_time(read_png, path, args.repeat)
+            size_mb = os.path.getsize(path) / 2**20
+            print(
+                f"{width:>5}x{height:<5} {size_mb:>7.1f} {old:>11.3f} "
+                f"{new:>11.3f} {old / new:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+import tifffile
+
+from sem_scale_bar import core
+from sem_scale_bar.core import (
+    VENDOR_TAGS,
+    cut_panel,
+    draw_bar,
+    get_bar,
+    get_scale,
+    get_tags_from_tiff,
+    image_kind,
+    parse_metadata,
+    png2np,
+    read_png,
+    save_image,
+    tif2np,
+)
+
+FIXTURES = "images for test"
+VENDORS = ("zeiss", "tescan", "fei")
+STAGES = (
+    "open",
+    "tags",
+    "decode",
+    "metadata",
+    "cut_panel",
+    "scale",
+    "draw_bar_cold",
+    "draw_bar",
+    "save_lzw",
+    "save_raw",
+)
+ZEISS_TAG = 34118  # CZ_SEM
+FEI_TAG = 34682  # FEI_HELIOS
+TESCAN_TAG = 50431
+
+
+def zeiss_tag(fixtures):
+    # CZ_SEM is a binary blob; borrow the one of a Zeiss test image
+    with tifffile.TiffFile(os.path.join(fixtures, "Zeiss_1.tif")) as tif:
+        tag = tif.pages[0].tags[ZEISS_TAG]
+        tif.filehandle.seek(tag.valueoffset)
+        return tif.filehandle.read(tag.count)
+
+
+def synthetic_frame(vendor, width, fixtures):
+    # noise in 0..191 with an info panel of about 1/10 of the frame height at
+    # the bottom; returns the full frame and the vendor tag for tifffile
+    height = width * 3 // 4
+    panel = height // 10
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 192, (height + panel, width), dtype=np.uint8)
+    img[height:] = 0
+    if vendor == "zeiss":
+        img[height] = 192  # the panel frame that cut_panel looks for
+        img[-2] = 192
+        extratag = (ZEISS_TAG, "s", 0, zeiss_tag(fixtures), True)
+    elif vendor == "tescan":
+        text = f"[MAIN]\r\nPixelSizeX=5e-09\r\nImageStripSize={panel}\r\n"
+        extratag = (TESCAN_TAG, "B", 0, text.encode(), True)
+    else:
+        text = f"[Beam]\r\nHFW={width * 5e-6:.6f} mm\r\n[Scan]\r\nResolutionY={height}\r\n"
+        extratag = (FEI_TAG, "s", 0, text, True)
+    return img, extratag
+
+
+def write_synthetic(path, vendor, width, fixtures):
+    img, extratag = synthetic_frame(vendor, width, fixtures)
+    tifffile.imwrite(path, img, extratags=[extratag], bigtiff=img.nbytes > 2**31)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run_once(path, work_dir, options):
+    lang, rect_color, corner, label, label_corner, use_standard_sizes = options
+    kind = image_kind(os.path.splitext(path)[1][1:])
+    times = {}
+    if kind == "tif":
+        times["open"], tif = timed(tifffile.TiffFile, path)
+        with tif:
+            times["tags"], tags = timed(get_tags_from_tiff, tif, VENDOR_TAGS)
+            times["decode"], img = timed(tif2np, tif, path)
+    else:
+        times["open"] = times["tags"] = 0.0
+        times["decode"], (img, tags) = timed(read_png, path)
+        times["decode_png2np"], _ = timed(png2np, path)
+    times["metadata"], metadata = timed(parse_metadata, tags)
+    times["cut_panel"], crop = timed(cut_panel, img, metadata)
+    start = time.perf_counter()
+    get_bar(crop, get_scale(metadata), lang, use_standard_sizes)
+    times["scale"] = time.perf_counter() - start
+
+    def render():
+        return draw_bar(
+            crop,
+            metadata,
+            lang,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            use_standard_sizes,
+        )
+
+    # cold: nothing cached, as for the first file of a batch; warm: the
+    # overlay template is reused, as for the following files of a batch
+    core._overlay_template.cache_clear()
+    times["draw_bar_cold"], result = timed(render)
+    times["draw_bar"], result = timed(render)
+    sizes = {}
+    for name, lzw in (("save_lzw", True), ("save_raw", False)):
+        output = os.path.join(work_dir, f"out_{name}.{kind}")
+        times[name], _ = timed(save_image, result, output, kind, lzw)
+        sizes[name] = os.path.getsize(output)
+    return times, img.shape, sizes
+
+
+def bench_file(path, work_dir, options, repeat):
+    best = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            times, shape, sizes = run_once(path, work_dir, options)
+            for stage, seconds in times.items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+    return {
+        "file": os.path.basename(path),
+        "bytes": os.path.getsize(path),
+        "height": int(shape[0]),
+        "width": int(shape[1]),
+        "output_bytes": sizes,
+        "stages": best,
+    }
+
+
+def environment():
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "tifffile": tifffile.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # stages that got slower than baseline by more than tolerance (a fraction)
+    old = {(case["group"], case["file"]): case["stages"] for case in baseline["results"]}
+    slower = []
+    for case in results:
+        stages = old.get((case["group"], case["file"]), {})
+        for stage, seconds in case["stages"].items():
+            before = stages.get(stage)
+            if before and seconds > before * (1 + tolerance) and seconds - before > 1e-3:
+                slower.append((case["group"], case["file"], stage, before, seconds))
+    return slower
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Time every processing stage separately on the test images and on "
+            "synthetic Zeiss, Tescan and FEI frames, and write the results as JSON."
+        )
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[1024, 2048, 4096, 8192, 16384],
+        help="Widths of the synthetic frames; height is 3/4 of the width",
+    )
+    parser.add_argument(
+        "--vendors",
+        nargs="*",
+        choices=VENDORS,
+        default=list(VENDORS),
+        help="Metadata formats of the synthetic frames",
+    )
+    parser.add_argument(
+        "--fixtures",
+        default=FIXTURES,
+        help=f"Folder with real images (default: '{FIXTURES}')",
+    )
+    parser.add_argument(
+        "--no-fixtures", action="store_true", help="Skip the real images"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case")
+    parser.add_argument(
+        "--output", default="stages.json", help="JSON results file (default: stages.json)"
+    )
+    parser.add_argument(
+        "--compare", help="Earlier JSON results; report the stages that got slower"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown for --compare, as a fraction (default: 0.2)",
+    )
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    options = ("English", "white", "right", "", "left", False)
+    cases = []
+    if not args.no_fixtures:
+        for name in sorted(os.listdir(args.fixtures)):
+            path = os.path.join(args.fixtures, name)
+            if os.path.isfile(path) and image_kind(os.path.splitext(name)[1][1:]):
+                cases.append(("fixtures", path))
+
+    results = []
+    print(f"{'case':<24} {'MPix':>6} " + " ".join(f"{stage:>13}" for stage in STAGES))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for vendor in args.vendors:
+            for width in args.sizes:
+                path = os.path.join(work_dir, f"{vendor}_{width}.tif")
+                write_synthetic(path, vendor, width, args.fixtures)
+                cases.append((vendor, path))
+        for group, path in cases:
+            case = bench_file(path, work_dir, options, args.repeat)
+            case["group"] = group
+            results.append(case)
+            if group != "fixtures":
+                os.remove(path)
+            megapixels = case["width"] * case["height"] / 1e6
+            print(
+                f"{group + '/' + case['file']:<24} {megapixels:>6.1f} "
+                + " ".join(f"{case['stages'].get(stage, 0):>13.4f}" for stage in STAGES)
+            )
+
+    with open(args.output, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            slower = compare(results, json.load(file), args.tolerance)
+        for group, name, stage, before, after in slower:
+            print(f"slower: {group}/{name} {stage} {before:.4f} s -> {after:.4f} s")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,22 @@
-from .core import *
+import importlib
 
+
+# the names of sem_scale_bar.core (numpy, Pillow, tifffile) are loaded on first
+# use, so that entry points which do not need them, like the server client,
+# start quickly; "from sem_scale_bar import *" works as before
+def __getattr__(name):
+    if name.startswith("__") and name != "__all__":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    core = importlib.import_module(f"{__name__}.core")
+    if name == "__all__":
+        return core.__all__
+    if name in core.__all__:
+        return getattr(core, name)
+    if name in globals():  # a submodule imported just now, such as core
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    core = importlib.import_module(f"{__name__}.core")
+    return sorted(set(globals()) | set(core.__all__))
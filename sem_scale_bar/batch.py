@@ -0,0 +1,226 @@
+import contextlib
+import io
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def resolve_jobs(jobs):
+    if jobs is None:
+        return 1
+    if jobs == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(jobs))
+
+
+def init_worker(ignore_interrupt=False):
+    # import the heavy modules and resolve the font once per worker process;
+    # with ignore_interrupt, Ctrl+C (sent to the whole process group) is left
+    # to the parent, which lets the files in progress finish
+    from sem_scale_bar import core
+
+    if ignore_interrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    core._load_font(80)
+
+
+def run_job(job):
+    # job: (file path, output path, process_file args and kwargs, whether to
+    # collect stats); returns (file path, output or None, printed messages,
+    # stats record or None). Used by the batch, watch, server and GUI pools.
+    from sem_scale_bar.core import process_file
+
+    file_path, output_path, file_args, file_kwargs, collect_stats = job
+    messages = io.StringIO()
+    record = {} if collect_stats else None
+    with contextlib.redirect_stdout(messages):
+        try:
+            result = process_file(
+                file_path,
+                *file_args,
+                output_path=output_path,
+                stats=record,
+                **file_kwargs,
+            )
+        except Exception as error:
+            print("Error during procession ", file_path, ".", error)
+            result = None
+    return file_path, result, messages.getvalue(), record
+
+
+def _stop_pending(cancel, pending):
+    if cancel is None or not cancel.is_set():
+        return False
+    for future in pending:
+        future.cancel()  # only the items that have not started
+    return True
+
+
+def imap_ordered(func, items, jobs, initializer=None, cancel=None):
+    # results come back in input order; at most 2 * jobs items are in flight
+    # so that a long listing is consumed lazily. Once cancel (an Event) is set,
+    # no more items are started and only the running ones are returned; with
+    # cancel only jobs items are in flight, so none is queued behind them.
+    in_flight = jobs if cancel is not None else 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                if _stop_pending(cancel, pending):
+                    break
+                pending.append(executor.submit(func, item))
+                if len(pending) >= in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                _stop_pending(cancel, pending)
+                future = pending.popleft()
+                if not future.cancelled():
+                    yield future.result()
+        finally:
+            # a consumer that stops early only waits for the running items
+            for future in pending:
+                future.cancel()
+
+
+def _unfinished(paths, journal, skipped):
+    for file_path, output_path in paths:
+        if journal.is_done(file_path):
+            print(f"Skipping {file_path}, already processed.")
+            skipped.append(file_path)
+        else:
+            yield file_path, output_path
+
+
+def run_batch(
+    paths,
+    file_args,
+    file_kwargs=None,
+    jobs=1,
+    pipeline=False,
+    queue_depth=2,
+    journal=None,
+    resume=False,
+    stats=None,
+    memory_budget=None,
+):
+    # paths yields (input path, output path or None); returns (processed, total)
+    # finished files are recorded in journal; with resume they are skipped;
+    # stats (a StatsRecorder) gets one record per processed file; with jobs > 1
+    # and memory_budget (bytes), files are started largest first while their
+    # estimated memory fits in the budget, see sem_scale_bar.scheduler
+    skipped = []
+    if journal is not None and resume:
+        paths = _unfinished(paths, journal, skipped)
+    try:
+        processed, total = _run_batch(
+            paths,
+            file_args,
+            file_kwargs or {},
+            jobs,
+            pipeline,
+            queue_depth,
+            journal,
+            stats,
+            memory_budget,
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+    return processed + len(skipped), total + len(skipped)
+
+
+def _run_batch(
+    paths,
+    file_args,
+    file_kwargs,
+    jobs,
+    pipeline,
+    queue_depth,
+    journal,
+    stats,
+    memory_budget=None,
+):
+    from sem_scale_bar.core import process_file
+
+    processed = 0
+    total = 0
+    if pipeline:
+        from sem_scale_bar.pipeline import iter_pipeline
+
+        for job in iter_pipeline(
+            paths, file_args, file_kwargs, queue_depth, stats is not None
+        ):
+            print(f"Processing {job['path']}...")
+            total += 1
+            if stats is not None:
+                stats.add(job["stats"])
+            if job["message"] is None:
+                processed += 1
+                if journal is not None:
+                    journal.record(job["path"], job["output_file"])
+            else:
+                print(job["message"])
+        return processed, total
+
+    if jobs <= 1:
+        for file_path, output_path in paths:
+            print(f"Processing {file_path}...")
+            total += 1
+            record = {} if stats is not None else None
+            result = process_file(
+                file_path,
+                *file_args,
+                output_path=output_path,
+                stats=record,
+                **file_kwargs,
+            )
+            if stats is not None:
+                stats.add(record)
+            if result:
+                processed += 1
+                if journal is not None:
+                    journal.record(file_path, result)
+        return processed, total
+
+    jobs_iter = (
+        (file_path, output_path, file_args, file_kwargs, stats is not None)
+        for file_path, output_path in paths
+    )
+    if memory_budget:
+        results = _budgeted(jobs_iter, file_kwargs, jobs, memory_budget)
+    else:
+        results = imap_ordered(run_job, jobs_iter, jobs, initializer=init_worker)
+    for file_path, result, messages, record in results:
+        print(f"Processing {file_path}...")
+        if messages:
+            print(messages, end="")
+        total += 1
+        if stats is not None:
+            stats.add(record)
+        if result:
+            processed += 1
+            if journal is not None:
+                journal.record(file_path, result)
+    return processed, total
+
+
+def _budgeted(jobs_iter, file_kwargs, jobs, memory_budget):
+    from sem_scale_bar.scheduler import estimate_memory, imap_budgeted
+
+    items = list(jobs_iter)  # every header is read before the largest is started
+    estimates = []
+    for item in items:
+        estimate = estimate_memory(
+            item[0], file_kwargs.get("large_image"), file_kwargs.get("grayscale")
+        )
+        if estimate > memory_budget:
+            print(
+                f"{item[0]} needs about {estimate / 2**20:.0f} MB, more than "
+                "the memory budget; it will be processed alone."
+            )
+        estimates.append(estimate)
+    return imap_budgeted(
+        run_job, items, estimates, jobs, memory_budget, initializer=init_worker
+    )
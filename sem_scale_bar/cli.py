@@ -2,6 +2,76 @@ import argparse
 import os
 import sys
 
+from sem_scale_bar.encoders import (
+    ENCODERS,
+    PNG_STRATEGIES,
+    get_encoder,
+    tifffile_options,
+)
+from sem_scale_bar.previews import PREVIEW_FORMATS, parse_preview
+
+
+def _jobs_value(value):
+    if value == "auto":
+        return value
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid jobs value: {value!r}")
+    if jobs < 1:
+        raise argparse.ArgumentTypeError("jobs must be at least 1")
+    return jobs
+
+
+def _size_value(value):
+    from sem_scale_bar.scheduler import parse_size
+
+    try:
+        return parse_size(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def _depth_value(value):
+    try:
+        depth = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid depth: {value!r}")
+    if depth < 0:
+        raise argparse.ArgumentTypeError("depth must be at least 0")
+    return depth
+
+
+def _add_discovery_arguments(parser):
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help=(
+            "Only process images matching GLOB, a file name pattern or, with a "
+            "'/', a path relative to the input folder. Repeatable"
+        ),
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="Skip images and folders matching GLOB. Repeatable",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=_depth_value,
+        metavar="N",
+        help="Only look N folder levels below the input folder (0: no subfolders)",
+    )
+
+
+def _preview_value(value):
+    try:
+        return parse_preview(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
 
 def build_parser():
     parser = argparse.ArgumentParser(
@@ -65,6 +135,49 @@ def build_parser():
         action="store_false",
         help="Disable LZW compression for TIFF outputs (default: enabled)",
     )
+    parser.add_argument(
+        "--encoder",
+        choices=ENCODERS,
+        help=(
+            "TIFF output encoder: lzw or raw (Pillow, as --no-lzw-compression), "
+            "deflate or zstd (tiled, with horizontal predictor, compressed in "
+            "threads; zstd needs imagecodecs). Default: lzw"
+        ),
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        help="Compression level for the deflate (0-9) and zstd (1-22) encoders",
+    )
+    parser.add_argument(
+        "--encoder-threads",
+        type=int,
+        help="Threads compressing the tiles of one image (default: set by tifffile)",
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        help="zlib level for PNG outputs (default: Pillow's default, 6)",
+    )
+    parser.add_argument(
+        "--png-strategy",
+        choices=PNG_STRATEGIES,
+        help="zlib strategy for PNG outputs (default: default)",
+    )
+    parser.add_argument(
+        "--preview",
+        dest="previews",
+        action="append",
+        type=_preview_value,
+        metavar="SIZE[:FORMAT[:QUALITY]]",
+        help=(
+            "Also write a downsized copy, SIZE pixels on the longer side, next "
+            "to each output, e.g. 1024:jpeg:85 or 256:png. Formats: "
+            f"{', '.join(PREVIEW_FORMATS)} (default: jpeg). Repeatable"
+        ),
+    )
     parser.add_argument(
         "--output-dir",
         help=(
@@ -72,16 +185,165 @@ def build_parser():
             "filenames and preserves the input folder structure."
         ),
     )
+    _add_discovery_arguments(parser)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_jobs_value,
+        default=1,
+        help=(
+            "Number of worker processes for folder processing, or 'auto' "
+            "to use all CPU cores (default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=_size_value,
+        metavar="SIZE",
+        help=(
+            "With --jobs, start files largest first and only while their "
+            "memory, estimated from the image headers, fits in SIZE "
+            "(e.g. 8G or 512M). The whole input tree is listed and every "
+            "header read before the first file starts"
+        ),
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help=(
+            "Overlap reading, decoding, rendering and encoding of consecutive "
+            "files in separate threads"
+        ),
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=2,
+        help=(
+            "Number of files buffered between two pipeline stages; caps the "
+            "memory used by --pipeline (default: 2)"
+        ),
+    )
+    parser.add_argument(
+        "--large-images",
+        dest="large_image",
+        action="store_true",
+        help=(
+            "Memory-map TIFF inputs and write tiled outputs tile by tile, for "
+            "montages that do not fit in RAM"
+        ),
+    )
+    parser.add_argument(
+        "--stack",
+        action="store_true",
+        help=(
+            "Process every page of multi-page TIFFs (FIB-SEM serial sections) "
+            "into a multi-page output, one page in memory at a time; by "
+            "default only the first page is processed"
+        ),
+    )
+    parser.add_argument(
+        "--grayscale",
+        action="store_true",
+        help=(
+            "Save 8-bit grayscale outputs instead of RGB; the scale bar and "
+            "label are black and white, so they look the same"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep running and process new images as they appear in the input "
+            "folder, once they are completely written"
+        ),
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.25,
+        help=(
+            "Seconds between two scans of the watched folder; a file is "
+            "processed when it is unchanged between two scans (default: 0.25)"
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help=(
+            "Write per-file timings, sizes and memory use as JSON lines to FILE "
+            "and print a throughput summary at the end"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Record finished files in a journal and skip the ones already "
+            "recorded with the same options on the next run"
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Process files even if the journal lists them as finished",
+    )
+    parser.add_argument(
+        "--journal",
+        help=(
+            "Journal file used by --resume (default: .sem_scale_bar_journal.jsonl "
+            "in the output folder, or in the input folder)"
+        ),
+    )
     return parser
 
 
-def iter_image_paths(path):
-    if os.path.isdir(path):
-        for root, _, files in os.walk(path):
-            for file_name in files:
-                yield os.path.join(root, file_name)
-    else:
-        yield path
+def iter_image_paths(
+    path, k=None, include=None, exclude=None, max_depth=None, skip_dir=None
+):
+    # image files below path, see sem_scale_bar.discovery.iter_images
+    from sem_scale_bar.discovery import iter_images
+
+    return iter_images(path, k, include, exclude, max_depth, skip_dir)
+
+
+def build_file_options(
+    language,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    k,
+    use_standard_sizes,
+    end_ticks,
+    lzw_compression,
+    large_image=False,
+    grayscale=False,
+    encoder=None,
+    previews=None,
+    stack=False,
+):
+    # process_file arguments (positional, keyword) of a batch; CLI runs and
+    # server jobs both get them from here, so they render the same way
+    file_args = (
+        language,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        k,
+        use_standard_sizes,
+        end_ticks,
+        lzw_compression,
+    )
+    file_kwargs = {"large_image": large_image, "grayscale": grayscale}
+    if encoder is not None:
+        file_kwargs["encoder"] = encoder
+    if previews:
+        file_kwargs["previews"] = previews
+    if stack:
+        file_kwargs["stack"] = True
+    return file_args, file_kwargs
 
 
 def process_path(
@@ -96,36 +358,267 @@ def process_path(
     end_ticks,
     lzw_compression,
     output_dir=None,
+    jobs=1,
+    pipeline=False,
+    queue_depth=2,
+    large_image=False,
+    grayscale=False,
+    resume=False,
+    force=False,
+    journal_path=None,
+    watch=False,
+    poll_interval=0.25,
+    stats_path=None,
+    encoder=None,
+    previews=None,
+    stack=False,
+    memory_budget=None,
+    include=None,
+    exclude=None,
+    max_depth=None,
 ):
-    from sem_scale_bar.core import build_output_path, process_file
+    from sem_scale_bar.batch import resolve_jobs, run_batch
+    from sem_scale_bar.core import build_output_path
+    from sem_scale_bar.discovery import iter_images
 
     input_root = path if os.path.isdir(path) else os.path.dirname(path)
-    for file_path in iter_image_paths(path):
-        print(f"Processing {file_path}...")
-        output_path = build_output_path(file_path, output_dir, input_root)
-        process_file(
-            file_path,
-            language,
-            rect_color,
-            corner,
-            label,
-            label_corner,
-            k,
-            use_standard_sizes,
-            end_ticks,
-            lzw_compression,
-            output_path=output_path,
+    file_args, file_kwargs = build_file_options(
+        language,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        k,
+        use_standard_sizes,
+        end_ticks,
+        lzw_compression,
+        large_image=large_image,
+        grayscale=grayscale,
+        encoder=encoder,
+        previews=previews,
+        stack=stack,
+    )
+    journal = None
+    if resume or force or journal_path:
+        from sem_scale_bar.journal import Journal, default_journal_path, options_key
+
+        journal = Journal(
+            journal_path or default_journal_path(input_root, output_dir),
+            options_key(file_args, file_kwargs),
+        )
+    stats = None
+    if stats_path:
+        from sem_scale_bar.stats import StatsRecorder
+
+        stats = StatsRecorder(stats_path)
+    try:
+        if watch:
+            from sem_scale_bar.watch import watch_folder
+
+            return watch_folder(
+                path,
+                file_args,
+                file_kwargs,
+                output_dir=output_dir,
+                jobs=resolve_jobs(jobs),
+                poll_interval=poll_interval,
+                journal=journal,
+                stats=stats,
+                include=include,
+                exclude=exclude,
+                max_depth=max_depth,
+            )
+        paths = (
+            (file_path, build_output_path(file_path, output_dir, input_root))
+            for file_path in iter_images(
+                path, k, include, exclude, max_depth, skip_dir=output_dir
+            )
+        )
+        return run_batch(
+            paths,
+            file_args,
+            file_kwargs,
+            jobs=resolve_jobs(jobs),
+            pipeline=pipeline,
+            queue_depth=queue_depth,
+            journal=journal,
+            resume=resume and not force,
+            stats=stats,
+            memory_budget=memory_budget,
+        )
+    finally:
+        if stats is not None:
+            stats.close()
+            print(stats.summary())
+
+
+def build_inspect_parser():
+    parser = argparse.ArgumentParser(
+        prog="sem_scale_bar.cli inspect",
+        description=(
+            "Report vendor, pixel size, info-panel height and image size of "
+            "SEM images from their headers, without decoding the pixels."
+        ),
+    )
+    parser.add_argument(
+        "input",
+        help="Input file or folder containing SEM images",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["csv", "json"],
+        default="csv",
+        help="Output format: CSV table or JSON lines (default: csv)",
+    )
+    parser.add_argument(
+        "--output",
+        help="Write the report to this file instead of the console",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_jobs_value,
+        default=1,
+        help="Number of worker processes, or 'auto' for all CPU cores (default: 1)",
+    )
+    _add_discovery_arguments(parser)
+    return parser
+
+
+def inspect_main(argv=None):
+    import csv
+    import json
+
+    from sem_scale_bar.batch import resolve_jobs
+    from sem_scale_bar.discovery import iter_images
+    from sem_scale_bar.metadata import INSPECT_FIELDS, iter_inspect
+
+    parser = build_inspect_parser()
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        parser.error(f"Input path not found: {args.input}")
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = None
+        if args.format == "csv":
+            writer = csv.DictWriter(output, fieldnames=INSPECT_FIELDS)
+            writer.writeheader()
+        paths = iter_images(
+            args.input, None, args.include, args.exclude, args.max_depth
         )
+        records = iter_inspect(paths, resolve_jobs(args.jobs))
+        for record in records:
+            if writer:
+                writer.writerow(record)
+            else:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def build_encoder(args, parser):
+    # None keeps the Pillow writers selected by --no-lzw-compression
+    if args.compression_level is not None and args.encoder not in ("deflate", "zstd"):
+        parser.error("--compression-level needs --encoder deflate or zstd")
+    if args.encoder_threads is not None and args.encoder not in ("deflate", "zstd"):
+        parser.error("--encoder-threads needs --encoder deflate or zstd")
+    if args.encoder == "lzw" and not args.lzw_compression:
+        parser.error("--encoder lzw cannot be combined with --no-lzw-compression")
+    if (
+        args.encoder is None
+        and args.compression_level is None
+        and args.png_compress_level is None
+        and args.png_strategy is None
+    ):
+        return None
+    try:
+        return get_encoder(
+            args.encoder or ("lzw" if args.lzw_compression else "raw"),
+            level=args.compression_level,
+            threads=args.encoder_threads,
+            png_level=args.png_compress_level,
+            png_strategy=args.png_strategy,
+        )
+    except ValueError as error:
+        parser.error(str(error))
+
+
+def check_tifffile_codec(args, encoder, parser):
+    # --large-images and --stack write through tifffile, which needs
+    # imagecodecs for lzw and zstd; refuse before any file is written
+    if args.large_image or args.stack:
+        try:
+            tifffile_options(args.lzw_compression, encoder)
+        except ValueError as error:
+            parser.error(str(error))
+
+
+def file_options(args, parser):
+    # process_file arguments (positional, keyword) for parsed options
+    encoder = build_encoder(args, parser)
+    check_tifffile_codec(args, encoder, parser)
+    return build_file_options(
+        args.language,
+        args.background_color,
+        args.scale_bar_corner,
+        args.label_text,
+        args.label_corner,
+        args.output_index,
+        args.standard_sizes,
+        args.end_ticks,
+        args.lzw_compression,
+        large_image=args.large_image,
+        grayscale=args.grayscale,
+        encoder=encoder,
+        previews=args.previews,
+        stack=args.stack,
+    )
 
 
 def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == "inspect":
+        return inspect_main(argv[1:])
+    if argv and argv[0] == "serve":
+        from sem_scale_bar.server import serve_main
+
+        return serve_main(argv[1:])
+    if argv and argv[0] == "client":
+        from sem_scale_bar.client import client_main
+
+        return client_main(argv[1:])
+
     parser = build_parser()
     args = parser.parse_args(argv)
 
     if not os.path.exists(args.input):
         parser.error(f"Input path not found: {args.input}")
+    if args.pipeline and args.jobs != 1:
+        parser.error("--pipeline cannot be combined with --jobs")
+    if args.pipeline and args.large_image:
+        parser.error("--pipeline cannot be combined with --large-images")
+    if args.pipeline and args.stack:
+        parser.error("--pipeline cannot be combined with --stack")
+    if args.memory_budget and (args.pipeline or args.watch):
+        parser.error("--memory-budget cannot be combined with --pipeline or --watch")
+    if args.memory_budget and args.jobs == 1:
+        parser.error("--memory-budget needs --jobs N or --jobs auto")
+    if args.queue_depth < 1:
+        parser.error("--queue-depth must be at least 1")
+    if args.watch and not os.path.isdir(args.input):
+        parser.error("--watch needs an input folder")
+    if args.watch and args.pipeline:
+        parser.error("--watch cannot be combined with --pipeline")
+    if args.poll_interval <= 0:
+        parser.error("--poll-interval must be positive")
+    encoder = build_encoder(args, parser)
+    check_tifffile_codec(args, encoder, parser)
 
-    process_path(
+    processed, total = process_path(
         args.input,
         args.language,
         args.background_color,
@@ -137,7 +630,26 @@ def main(argv=None):
         args.end_ticks,
         args.lzw_compression,
         output_dir=args.output_dir,
+        jobs=args.jobs,
+        pipeline=args.pipeline,
+        queue_depth=args.queue_depth,
+        large_image=args.large_image,
+        grayscale=args.grayscale,
+        resume=args.resume,
+        force=args.force,
+        journal_path=args.journal,
+        watch=args.watch,
+        poll_interval=args.poll_interval,
+        stats_path=args.stats,
+        encoder=encoder,
+        previews=args.previews,
+        stack=args.stack,
+        memory_budget=args.memory_budget,
+        include=args.include,
+        exclude=args.exclude,
+        max_depth=args.max_depth,
     )
+    print(f"{processed} of {total} files processed.")
     if args.output_dir:
         print("Processing complete. Check the output folder for outputs.")
     else:
@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import sys
+
+# only the standard library is imported here, so a client call stays cheap
+DEFAULT_SERVER = "http://127.0.0.1:8765"
+
+
+def default_token_file(port):
+    # written by the server at start, readable by its user only
+    return os.path.join(os.path.expanduser("~"), f".sem_scale_bar_server_{port}.token")
+
+
+def read_token(path):
+    with open(path, encoding="ascii") as file:
+        return file.read().strip()
+
+
+def _request(url, token, body=None):
+    from urllib import error, request
+
+    data = None if body is None else json.dumps(body).encode()
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    req = request.Request(url, data=data, headers=headers)
+    try:
+        with request.urlopen(req) as response:
+            return json.loads(response.read())
+    except error.HTTPError as http_error:
+        return json.loads(http_error.read() or b"{}") or {"error": str(http_error)}
+
+
+def build_client_parser():
+    parser = argparse.ArgumentParser(
+        prog="sem_scale_bar.cli client",
+        description=(
+            "Send an image or folder to a running 'sem_scale_bar.cli serve'. "
+            "Options after the input are the processing options of the CLI."
+        ),
+    )
+    parser.add_argument(
+        "--server",
+        default=DEFAULT_SERVER,
+        help="Server address",
+    )
+    parser.add_argument(
+        "--token-file",
+        help=(
+            "File with the server's access token "
+            "(default: ~/.sem_scale_bar_server_<port>.token)"
+        ),
+    )
+    parser.add_argument(
+        "--no-wait",
+        dest="wait",
+        action="store_false",
+        help="Return after queuing the job instead of waiting for it",
+    )
+    parser.add_argument(
+        "--status",
+        nargs="?",
+        const="all",
+        metavar="JOB",
+        help="Print the status of a job, or of the server",
+    )
+    parser.add_argument("input", nargs="?", help="Image file or folder")
+    parser.add_argument("options", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser
+
+
+def _absolute_options(options):
+    # the server runs in another folder: relative output folders are made
+    # absolute here, as the input path is
+    options = list(options)
+    for index, option in enumerate(options):
+        if option == "--output-dir" and index + 1 < len(options):
+            options[index + 1] = os.path.abspath(options[index + 1])
+        elif option.startswith("--output-dir="):
+            value = option.partition("=")[2]
+            options[index] = f"--output-dir={os.path.abspath(value)}"
+    return options
+
+
+def client_main(argv=None):
+    from urllib.parse import urlsplit
+
+    parser = build_client_parser()
+    args = parser.parse_args(argv)
+    server = args.server.rstrip("/")
+    token_file = args.token_file or default_token_file(urlsplit(server).port or 80)
+    try:
+        token = read_token(token_file)
+    except OSError as error:
+        print(f"Cannot read the server token: {error}", file=sys.stderr)
+        return 2
+    try:
+        if args.status:
+            path = "/status" if args.status == "all" else f"/jobs/{args.status}"
+            status = _request(server + path, token)
+            print(json.dumps(status, ensure_ascii=False, indent=1))
+            return 0
+        if not args.input:
+            parser.error("an input path is needed")
+        status = _request(
+            server + "/jobs",
+            token,
+            {
+                "path": os.path.abspath(args.input),
+                "options": _absolute_options(args.options),
+                "wait": args.wait,
+            },
+        )
+        if "error" in status:
+            print(status["error"], file=sys.stderr)
+            return 2
+        if not args.wait:
+            print(f"Job {status['id']} queued with {status['total']} files.")
+            return 0
+    except OSError as error:
+        print(f"Cannot reach the server at {server}: {error}", file=sys.stderr)
+        return 2
+    for file in status["files"]:
+        print(f"Processing {file['path']}...")
+        if file["messages"]:
+            print(file["messages"], end="")
+    print(f"{status['processed']} of {status['total']} files processed.")
+    return 0 if not status["failed"] else 1
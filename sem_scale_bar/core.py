@@ -1,10 +1,20 @@
+import collections.abc
+import contextlib
+import functools
+import io
 import os
+import re
+import struct
+import threading
+import time
 
 import numpy as np
 import png
 import tifffile
 from PIL import Image, ImageDraw, ImageFont
 
+from sem_scale_bar.metadata import _PNG_SIGNATURE
+
 _FONT_CANDIDATES = (
     "arial.ttf",
     "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
@@ -14,25 +24,82 @@ _FONT_CANDIDATES = (
 )
 
 
-def _load_font(font_size):
+# the first usable font is looked up once per process; fonts and text
+# measurements are kept in bounded LRU caches (see font_cache_info)
+@functools.lru_cache(maxsize=None)
+def _font_path():
     for candidate in _FONT_CANDIDATES:
         try:
-            return ImageFont.truetype(candidate, font_size)
+            ImageFont.truetype(candidate, 10)
+            return candidate
         except OSError:
             continue
-    return ImageFont.load_default()
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def _load_font(font_size):
+    font_path = _font_path()
+    if font_path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, font_size)
+
+
+# FreeType faces are shared by all threads, so text is rasterised by one
+# thread at a time; the lock is only taken on cache misses and replays
+_TEXT_LOCK = threading.RLock()
+
+
+@functools.lru_cache(maxsize=None)
+def _measure_draw():
+    return ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+# (textlength, textbbox at (0, 0)); fonts come from _load_font, so a font
+# object stands for one (font file, size) pair
+@functools.lru_cache(maxsize=1024)
+def _text_metrics(font, text, stroke_width=0):
+    draw = _measure_draw()
+    with _TEXT_LOCK:
+        return (
+            draw.textlength(text, font=font),
+            draw.textbbox((0, 0), text, font=font, stroke_width=stroke_width),
+        )
+
+
+def font_cache_info():
+    return {
+        "fonts": _load_font.cache_info(),
+        "text_metrics": _text_metrics.cache_info(),
+    }
+
 
 __all__ = [
     "extract_png_chunks",
     "get_scale",
+    "get_strip_size",
+    "ImageMetadata",
+    "parse_metadata",
+    "register_vendor",
     "cut_panel",
     "tif2np",
     "png2np",
+    "read_png",
     "get_tags_from_tiff",
+    "LazyTags",
     "get_bar",
     "draw_bar",
     "build_output_path",
+    "image_kind",
+    "output_file_name",
+    "load_image",
+    "render_image",
+    "save_image",
     "process_file",
+    "process_bytes",
+    "process_array",
+    "font_cache_info",
+    "overlay_cache_info",
 ]
 
 
@@ -61,113 +128,241 @@ def extract_png_chunks(filename):
     return chunks
 
 
-def get_scale(tags):
-    pixel_size = 0  # for debugging
-    if "CZ_SEM" in tags:
-        try:  # for Zeiss images
-            length = tags["CZ_SEM"]["ap_image_pixel_size"][2]
-            if length == "nm":
-                pixel_size = float(
-                    tags["CZ_SEM"]["ap_image_pixel_size"][1] / 1000
-                )  # microns per pixel
-            else:  # length == 'pm':
-                pixel_size = float(
-                    tags["CZ_SEM"]["ap_image_pixel_size"][1] / 1000000
-                )  # microns per pixel
-        except:  # for LEO images
-            n = tags["ImageWidth"] / 1024  # to recalculate image resolution in meter per pixel
-            pixel_size = float(tags["CZ_SEM"][""][3] * 1000000) / n  # microns per pixel
-
-    elif "50431" in tags:
-        text = tags["50431"].split()  # for Tescan images
-        for j in range(len(text)):
-            find_pixel_size = str(text[j]).find("PixelSizeX")
-            if find_pixel_size != -1:
-                pixel_size = (
-                    float(str(text[j]).split("=")[1].strip("'")) * 1000000
-                )  # microns per pixel
-                break
-
-    elif "FEI_HELIOS" in tags:  # for FEI and SM-32 images
-        if "¦" in tags["FEI_HELIOS"]["Beam"]["HFW"]:
-            pixel_size = (
-                float(tags["FEI_HELIOS"]["Beam"]["HFW"].split("¦")[0])
-                / tags["ImageWidth"]
+# metadata of one image, parsed once per file: vendor, kind ("tif" or "png"),
+# pixel size in microns (0 when unknown), infopanel height in pixels (None for
+# unknown formats and for the vendors whose panel is found from the pixels)
+# and frame size. The functions below take it in place of the raw tags.
+class ImageMetadata:
+    __slots__ = ("vendor", "kind", "pixel_size", "strip_height", "width", "height")
+
+    def __init__(
+        self,
+        vendor=None,
+        kind="tif",
+        pixel_size=0,
+        strip_height=None,
+        width=None,
+        height=None,
+    ):
+        self.vendor = vendor
+        self.kind = kind
+        self.pixel_size = pixel_size
+        self.strip_height = strip_height
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+_TESCAN_KEYS = re.compile(rb"PixelSizeX|ImageStripSize")
+_TOKEN_END = re.compile(rb"\S*")
+_WHITESPACE = b" \t\n\r\x0b\x0c"  # what bytes.split() splits on
+
+
+def _tescan_values(text):
+    # one pass over the Tescan key=value text, which is tens of kilobytes;
+    # the first whitespace separated token that contains a key gives its value
+    if isinstance(text, str):
+        text = text.encode("utf-8", "surrogateescape")
+    values = {}
+    for match in _TESCAN_KEYS.finditer(text):
+        key = match.group()
+        if key in values:
+            continue
+        start = match.start()
+        while start and text[start - 1] not in _WHITESPACE:
+            start -= 1
+        token = text[start : _TOKEN_END.match(text, match.end()).end()]
+        values[key] = token.split(b"=")[1].decode("latin-1").strip("'")
+        if len(values) == 2:
+            break
+    pixel_size = 0
+    if b"PixelSizeX" in values:
+        pixel_size = float(values[b"PixelSizeX"]) * 1000000  # microns per pixel
+    strip_pixel_size = None
+    if b"ImageStripSize" in values:
+        # Tescan writes the infopanel height (in pixels) to "ImageStripSize"
+        strip_pixel_size = int(values[b"ImageStripSize"])
+    return pixel_size, strip_pixel_size
+
+
+def _parse_cz_sem(tags):
+    try:  # for Zeiss images
+        length = tags["CZ_SEM"]["ap_image_pixel_size"][2]
+        if length == "nm":
+            pixel_size = float(
+                tags["CZ_SEM"]["ap_image_pixel_size"][1] / 1000
             )  # microns per pixel
-        else:
-            pixel_size = (
-                float(tags["FEI_HELIOS"]["Beam"]["HFW"].split("mm")[0])
-                / tags["ImageWidth"]
-                * 1000
+        else:  # length == 'pm':
+            pixel_size = float(
+                tags["CZ_SEM"]["ap_image_pixel_size"][1] / 1000000
             )  # microns per pixel
+    except:  # for LEO images
+        n = tags["ImageWidth"] / 1024  # to recalculate image resolution in meter per pixel
+        pixel_size = float(tags["CZ_SEM"][""][3] * 1000000) / n  # microns per pixel
+    return pixel_size, None
+
+
+def _parse_tescan(tags):
+    return _tescan_values(tags["50431"])
+
+
+def _parse_tescan_png(tags):
+    return _tescan_values(tags[1][1])
+
 
+def _parse_fei(tags):  # for FEI and SM-32 images
+    if "¦" in tags["FEI_HELIOS"]["Beam"]["HFW"]:
+        pixel_size = (
+            float(tags["FEI_HELIOS"]["Beam"]["HFW"].split("¦")[0]) / tags["ImageWidth"]
+        )  # microns per pixel
     else:
-        try:
-            if b"gIFx" in tags[1]:  # metadata in png-image from Tescan microscope
-                text = tags[1][1].split()
-                for j in range(len(text)):
-                    find_pixel_size = str(text[j]).find("PixelSizeX")
-                    if find_pixel_size != -1:
-                        pixel_size = (
-                            float(str(text[j]).split("=")[1].strip("'")) * 1000000
-                        )  # microns per pixel
-                        break
-        except:
-            print("Unknown metadata format")
+        pixel_size = (
+            float(tags["FEI_HELIOS"]["Beam"]["HFW"].split("mm")[0])
+            / tags["ImageWidth"]
+            * 1000
+        )  # microns per pixel
+    short_height = tags["FEI_HELIOS"]["Scan"]["ResolutionY"]
+    full_height = tags["ImageLength"]
+    return pixel_size, full_height - short_height
 
-    return pixel_size
 
+def _is_zeiss(tags):
+    return "CZ_SEM" in tags and "ap_image_pixel_size" in tags["CZ_SEM"]
 
-def cut_panel(img, tags):
+
+def _is_leo(tags):
+    return "CZ_SEM" in tags
+
+
+def _is_tescan(tags):
+    return "50431" in tags
+
+
+def _is_fei(tags):
+    return "FEI_HELIOS" in tags
+
+
+def _is_tescan_png(tags):
+    try:
+        return b"gIFx" in tags[1]  # metadata in png-image from Tescan microscope
+    except (KeyError, IndexError, TypeError):
+        return False
+
+
+# index of the first row (from the top) whose [left:right] part equals reference;
+# rows are compared a block at a time instead of one Python iteration per row
+def _first_matching_row(img, reference, left, right, block_rows=256):
+    for start in range(0, img.shape[0], block_rows):
+        block = img[start : start + block_rows, left:right]
+        matches = np.all(block == reference, axis=1)
+        if matches.any():
+            return start + int(matches.argmax())
+    return None
+
+
+def _zeiss_panel(img):
     height, width = img.shape[:2]
-    if "CZ_SEM" in tags:
-        i = 0
-        if "ap_image_pixel_size" in tags["CZ_SEM"]:  # for Zeiss images
-            for row in img:
-                if np.all(
-                    row[2 : row.size - 3] == img[-2][2 : row.size - 3]
-                ):  # img[-2] is a lower part of the infopanel frame; we want to find the upper part of the frame
-                    strip_pixel_size = height - i
-                    break
-                i += 1
-        else:  # for LEO images
-            black_row = np.zeros(width - 6)
-            for row in img:
-                if np.all(black_row == row[3 : row.size - 3]):
-                    strip_pixel_size = height - i
-                    break
-                i += 1
-
-    elif "50431" in tags:
-        text = tags["50431"].split()  # for Tescan images
-        for j in range(len(text)):
-            start_strip = str(text[j]).find(
-                "ImageStripSize"
-            )  # Tescan writes the infopanel height (in pixels) to the metadata parameter "ImageStripSize"
-            if start_strip != -1:
-                strip_pixel_size = int(str(text[j]).split("=")[1].strip("'"))
-                break
-
-    elif "FEI_HELIOS" in tags:  # for FEI and SM-32 images
-        short_height = tags["FEI_HELIOS"]["Scan"]["ResolutionY"]
-        full_height = tags["ImageLength"]
-        strip_pixel_size = full_height - short_height
+    # img[-2] is a lower part of the infopanel frame; we want to find the upper part of the frame
+    i = _first_matching_row(img, img[-2][2 : width - 3], 2, width - 3)
+    return None if i is None else height - i
+
+
+def _leo_panel(img):
+    height, width = img.shape[:2]
+    black_row = np.zeros(width - 6)
+    i = _first_matching_row(img, black_row, 3, width - 3)
+    return None if i is None else height - i
+
+
+# (name, detect(tags), parse(tags) -> (pixel size, infopanel height)), tried in
+# order; PANEL_FINDERS maps the vendors whose metadata has no infopanel height
+# to find_panel(img) -> infopanel height
+VENDORS = [
+    ("Zeiss", _is_zeiss, _parse_cz_sem),
+    ("LEO", _is_leo, _parse_cz_sem),
+    ("Tescan", _is_tescan, _parse_tescan),
+    ("FEI", _is_fei, _parse_fei),
+    ("Tescan", _is_tescan_png, _parse_tescan_png),
+]
+PANEL_FINDERS = {"Zeiss": _zeiss_panel, "LEO": _leo_panel}
+# TIFF tags read by the parsers, decoded when a file is opened (see LazyTags)
+VENDOR_TAGS = {"ImageWidth", "ImageLength", "CZ_SEM", "50431", "FEI_HELIOS"}
+
 
+def register_vendor(name, detect, parse, find_panel=None, first=True, tags=()):
+    # new vendors are tried before the built-in ones unless first is False;
+    # tags: names of the TIFF tags that parse reads
+    entry = (name, detect, parse)
+    if first:
+        VENDORS.insert(0, entry)
     else:
-        try:
-            if b"gIFx" in tags[1]:  # metadata in png-image from Tescan microscope
-                text = tags[1][1].split()
-                for j in range(len(text)):
-                    start_strip = str(text[j]).find(
-                        "ImageStripSize"
-                    )  # Tescan writes the infopanel height (in pixels) to the metadata parameter "ImageStripSize"
-                    if start_strip != -1:
-                        strip_pixel_size = int(str(text[j]).split("=")[1].strip("'"))
-                        break
-        except:
-            print(
-                "Unknown metadata format. Only Zeiss, Tescan or LEO SEM initial images can be processed."
+        VENDORS.append(entry)
+    if find_panel is not None:
+        PANEL_FINDERS[name] = find_panel
+    VENDOR_TAGS.update(tags)
+
+
+def detect_vendor(tags):
+    for name, detect, _ in VENDORS:
+        if detect(tags):
+            return name
+    return None
+
+
+def _frame_size(tags):
+    if isinstance(tags, collections.abc.Mapping):
+        return tags.get("ImageWidth"), tags.get("ImageLength")
+    for chunk_type, chunk_data in tags:  # png chunks
+        if chunk_type == b"IHDR":
+            return struct.unpack(">II", chunk_data[:8])
+    return None, None
+
+
+def parse_metadata(tags):
+    # tags: as get_tags_from_tiff or extract_png_chunks return them
+    if isinstance(tags, ImageMetadata):
+        return tags
+    kind = "tif" if isinstance(tags, collections.abc.Mapping) else "png"
+    width, height = _frame_size(tags)
+    for name, detect, parse in VENDORS:
+        if detect(tags):
+            pixel_size, strip_pixel_size = parse(tags)
+            return ImageMetadata(
+                name, kind, pixel_size, strip_pixel_size, width, height
             )
+    return ImageMetadata(None, kind, 0, None, width, height)
+
+
+# tags may be the raw tags or their ImageMetadata
+def get_scale(tags):
+    metadata = parse_metadata(tags)
+    if metadata.vendor is None and metadata.kind == "tif":
+        print("Unknown metadata format")
+    return metadata.pixel_size
+
+
+def get_strip_size(tags):
+    # infopanel height for the vendors that record it in the metadata;
+    # Zeiss and LEO panels are found from the pixels in cut_panel
+    metadata = parse_metadata(tags)
+    if metadata.vendor is None and metadata.kind == "tif":
+        print(
+            "Unknown metadata format. Only Zeiss, Tescan or LEO SEM initial images can be processed."
+        )
+    return metadata.strip_height
+
+
+def cut_panel(img, tags):
+    metadata = parse_metadata(tags)
+    height, width = img.shape[:2]
+    find_panel = PANEL_FINDERS.get(metadata.vendor)
+    if metadata.strip_height is None and find_panel is not None:
+        strip_pixel_size = find_panel(img)
+    else:
+        strip_pixel_size = get_strip_size(metadata)
 
     h = height - strip_pixel_size
     crop = img[0:h, 0:width]
@@ -175,29 +370,134 @@ def cut_panel(img, tags):
     return crop
 
 
-def tif2np(tif, name):
-    img = tif.pages[0].asarray()
+# 16-bit -> 8-bit table, the same values as truncating float32(value / 255) to 0..255
+_LUT_16_TO_8 = np.minimum(np.arange(65536) // 255, 255).astype(np.uint8)
+
+
+# uint8 frames are kept as they are and uint16 frames with values above 255
+# stay 16-bit until draw_bar, so cut_panel compares the original values;
+# anything else takes the float32 path
+def _native_image(img):
     if len(img.shape) > 2:
         img = img.mean(axis=0)
     assert len(img.shape) == 2
-    if img.max() > 255:
+    if img.dtype == np.uint8:
+        return img
+    img_max = img.max()
+    if img.dtype == np.uint16:
+        return img if img_max > 255 else img.astype(np.uint8)
+    if img_max > 255:
         img = img / 255
     return img.astype(np.float32)
 
 
+def _to_8bit(img):
+    if img.dtype == np.uint16:
+        return _LUT_16_TO_8[img]
+    return img
+
+
+def tif2np(tif, name):
+    return _native_image(tif.pages[0].asarray())
+
+
 def png2np(filename):
     reader = png.Reader(filename)
     _, _, pixels, _ = reader.read()
     img = np.vstack([row for row in pixels])
-    if len(img.shape) > 2:
-        img = img.mean(axis=0)
-    assert len(img.shape) == 2
-    if img.max() > 255:
-        img = img / 255
-    return img.astype(np.float32)
+    return _native_image(img)
+
+
+# (type, data) of every chunk, as extract_png_chunks returns them;
+# IDAT payloads are views into the buffer instead of copies
+def _split_png_chunks(data):
+    view = memoryview(data)
+    if bytes(view[:8]) != _PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    chunks = []
+    position = 8
+    while position + 8 <= len(view):
+        length, chunk_type = struct.unpack_from(">I4s", view, position)
+        chunk_data = view[position + 8 : position + 8 + length]
+        if chunk_type != b"IDAT":
+            chunk_data = bytes(chunk_data)
+        chunks.append((chunk_type, chunk_data))
+        position += length + 12
+        if chunk_type == b"IEND":
+            break
+    return chunks
+
+
+# single pass over a PNG: the file is read once and both the metadata chunks
+# and the pixels come from that buffer; returns (img, chunks)
+def read_png(source):
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            data = file.read()
+    elif hasattr(source, "read"):
+        data = source.read()
+    else:
+        data = source
+    chunks = _split_png_chunks(data)
+    width, height, bitdepth, color_type = struct.unpack(">IIBB", chunks[0][1][:10])
+    img = None
+    if color_type == 0 and bitdepth in (8, 16):  # greyscale, decoded by PIL in C
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                img = np.asarray(image)
+        except Image.DecompressionBombError:
+            pass
+        if img is not None and bitdepth == 16:
+            img = img.astype(np.uint16, copy=False)
+    if img is None:
+        _, _, pixels, info = png.Reader(bytes=data).read()
+        img = np.empty(
+            (height, width * info["planes"]),
+            dtype=np.uint8 if bitdepth <= 8 else np.uint16,
+        )
+        for i, row in enumerate(pixels):
+            img[i] = row
+    return _native_image(img), chunks
+
+
+# name -> value mapping of the tags of a TIFF page: the tags in names are
+# decoded right away, the others (strip tables, color maps, vendor blobs) only
+# when they are looked up (tifffile reopens the file, with a warning, for
+# lookups after it was closed). Membership tests never decode.
+class LazyTags(collections.abc.Mapping):
+    __slots__ = ("_tags", "_values")
+
+    def __init__(self, page_tags, names):
+        self._tags = {tag.name: tag for tag in page_tags.values()}
+        self._values = {
+            name: self._tags[name].value for name in names if name in self._tags
+        }
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = self._tags[name].value
+            return value
+
+    def __contains__(self, name):
+        return name in self._tags
+
+    def __iter__(self):
+        return iter(self._tags)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({sorted(self._tags)!r})"
 
 
-def get_tags_from_tiff(tif):
+# tags of the first page only; names (such as VENDOR_TAGS) selects the tags
+# to decode now and returns a LazyTags, None decodes every tag into a dict
+def get_tags_from_tiff(tif, names=None):
+    if names is not None:
+        return LazyTags(tif.pages[0].tags, names)
     tif_tags = {}
     for tag in tif.pages[0].tags.values():
         name, value = tag.name, tag.value
@@ -205,7 +505,10 @@ def get_tags_from_tiff(tif):
     return tif_tags
 
 
+# pixel_size in microns, or the ImageMetadata of the image
 def get_bar(img, pixel_size, lang, use_standard_sizes):
+    if isinstance(pixel_size, ImageMetadata):
+        pixel_size = pixel_size.pixel_size
     _, width = img.shape[:2]
     bar = (
         width * pixel_size / 6
@@ -246,6 +549,84 @@ def get_bar(img, pixel_size, lang, use_standard_sizes):
     return (bar, bar_pixel_size, scale)
 
 
+# records ImageDraw calls so the overlay can be replayed on the whole frame or,
+# shifted by an integer offset, on small patches cut from it
+class _Overlay:
+    def __init__(self):
+        self.operations = []
+
+    def textlength(self, text, font=None):
+        return _text_metrics(font, text)[0]
+
+    def textbbox(self, xy, text, font=None, stroke_width=0):
+        left, top, right, bottom = _text_metrics(font, text, stroke_width)[1]
+        return left + xy[0], top + xy[1], right + xy[0], bottom + xy[1]
+
+    def rectangle(self, xy, **kwargs):
+        self.operations.append(("rectangle", xy, kwargs))
+
+    def line(self, xy, **kwargs):
+        self.operations.append(("line", xy, kwargs))
+
+    def text(self, xy, text, **kwargs):
+        self.operations.append(("text", xy, dict(kwargs, text=text)))
+
+    def replay(self, draw, offset=(0, 0)):
+        dx, dy = offset
+        for name, xy, kwargs in self.operations:
+            if name == "text":
+                kwargs = dict(kwargs)
+                draw.text((xy[0] - dx, xy[1] - dy), kwargs.pop("text"), **kwargs)
+            else:
+                getattr(draw, name)([(x - dx, y - dy) for x, y in xy], **kwargs)
+
+    # integer boxes (left, top, right, bottom) around every operation,
+    # clipped to the frame and merged where they overlap
+    def boxes(self, width, height):
+        boxes = []
+        for name, xy, kwargs in self.operations:
+            if name == "text":
+                left, top, right, bottom = self.textbbox(
+                    xy,
+                    kwargs["text"],
+                    font=kwargs.get("font"),
+                    stroke_width=kwargs.get("stroke_width", 0),
+                )
+                pad = 2
+            else:
+                xs = [x for x, _ in xy]
+                ys = [y for _, y in xy]
+                left, top, right, bottom = min(xs), min(ys), max(xs), max(ys)
+                pad = (kwargs.get("width") or 1) + 2
+            box = [
+                max(0, int(np.floor(left)) - pad),
+                max(0, int(np.floor(top)) - pad),
+                min(width, int(np.ceil(right)) + pad + 1),
+                min(height, int(np.ceil(bottom)) + pad + 1),
+            ]
+            if box[0] < box[2] and box[1] < box[3]:
+                boxes.append(box)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [
+                            min(a[0], b[0]),
+                            min(a[1], b[1]),
+                            max(a[2], b[2]),
+                            max(a[3], b[3]),
+                        ]
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(box) for box in boxes]
+
+
 def draw_bar(
     img,
     tags,
@@ -256,13 +637,125 @@ def draw_bar(
     label_corner,
     use_standard_sizes,
     end_ticks=False,
+    grayscale=False,
 ):
-    img1 = Image.fromarray(img)
-    img1 = img1.convert("RGB")
-    img2 = ImageDraw.Draw(img1)
+    # the bar, ticks and texts are only black and white, so an "L" result has
+    # the same values as each band of the "RGB" one
+    mode = "L" if grayscale else "RGB"
+    overlay = _overlay_template(
+        img.shape[1],
+        img.shape[0],
+        get_scale(tags),
+        lang,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+        mode,
+    )
+    img1 = Image.fromarray(_to_8bit(img))
+    img1 = img1.convert(mode)
+    for left, top, patch in _render_patches(img, overlay, mode=mode):
+        img1.paste(patch, (left, top))
+    return img1
+
+
+# overlay drawn on small patches cut from img; returns [(left, top, patch)]
+def _render_patches(img, overlay, to_8bit=_to_8bit, mode="RGB"):
+    patches = []
+    for (left, top, right, bottom), pixels, mask in overlay.templates:
+        patch = Image.fromarray(to_8bit(img[top:bottom, left:right]))
+        patch = patch.convert(mode)
+        if pixels is None:
+            with _TEXT_LOCK:
+                overlay.replay(ImageDraw.Draw(patch), (left, top))
+        else:
+            patch = np.array(patch)
+            np.copyto(patch, pixels, where=mask)
+            patch = Image.fromarray(patch, mode)
+        patches.append((left, top, patch))
+    return patches
+
+
+# Frames of one series share width, height, pixel size and options, so their
+# overlays are identical. A box of the overlay that does not depend on the
+# frame (a filled background with everything drawn inside it) is kept as
+# pixels plus a mask and copied into the next frames; other boxes (transparent
+# background, text reaching past the box) keep None and replay the drawing.
+@functools.lru_cache(maxsize=16)
+def _overlay_template(
+    width,
+    height,
+    pixel_size,
+    lang,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    use_standard_sizes,
+    end_ticks,
+    mode,
+):
+    shape_only = np.broadcast_to(np.uint8(0), (height, width))
+    overlay = _record_overlay(
+        shape_only,
+        pixel_size,
+        lang,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+    )
+    overlay.templates = []
+    for box in overlay.boxes(width, height):
+        left, top, right, bottom = box
+        rendered = []
+        for background in (0, 255):
+            patch = Image.new("L", (right - left, bottom - top), background)
+            patch = patch.convert(mode)
+            with _TEXT_LOCK:
+                overlay.replay(ImageDraw.Draw(patch), (left, top))
+            rendered.append(np.asarray(patch))
+        on_black, on_white = rendered
+        # drawing only blends towards black or white, so a pixel that comes
+        # out the same on both backgrounds is the same on any frame, and one
+        # that keeps both backgrounds is untouched
+        fixed = on_black == on_white
+        untouched = (on_black == 0) & (on_white == 255)
+        if mode == "RGB":
+            fixed = fixed.all(axis=2)
+            untouched = untouched.all(axis=2)
+        if np.all(fixed | untouched):
+            mask = fixed[:, :, None] if mode == "RGB" else fixed
+            overlay.templates.append((box, on_black, mask))
+        else:
+            overlay.templates.append((box, None, None))
+    return overlay
+
+
+def overlay_cache_info():
+    return _overlay_template.cache_info()
+
+
+# only img.shape is used, so img may be a memory-mapped frame
+def _record_overlay(
+    img,
+    pixel_size,
+    lang,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    use_standard_sizes,
+    end_ticks=False,
+):
+    img2 = _Overlay()
     height = img.shape[0]
 
-    pixel_size = get_scale(tags)
     bar_data = get_bar(img, pixel_size, lang, use_standard_sizes)
     bar = round(bar_data[1])
     scale_text = f"{bar_data[0]} {bar_data[2]}"
@@ -522,7 +1015,7 @@ def draw_bar(
             stroke_fill=outline_color if transparent_background else None,
         )
 
-    return img1
+    return img2
 
 
 def build_output_path(full_file_name, output_dir, input_root=None):
@@ -533,7 +1026,205 @@ def build_output_path(full_file_name, output_dir, input_root=None):
     return os.path.join(output_dir, relative_path)
 
 
-# read full file path, process file (read tif metadata, cut panel, draw scale bar) and save result
+def image_kind(extension):
+    if extension == "tif" or extension == "TIF" or extension == "tiff":
+        return "tif"
+    if extension == "png" or extension == "PNG":
+        return "png"
+    return None
+
+
+def output_file_name(full_file_name, k, output_path=None):
+    if output_path:
+        return output_path
+    folder, filename_ext = os.path.split(full_file_name)
+    short_file_name, extension = os.path.splitext(filename_ext)
+    return f"{folder}/{short_file_name}_cut_{k}{extension}"
+
+
+def error_message(full_file_name):
+    return f"Error during procession  {full_file_name} ."
+
+
+def unsupported_message(short_file_name, extension):
+    return (
+        f"File  {short_file_name} {extension}  "
+        "extension isn't 'tif' ('tiff'); it can't be processed."
+    )
+
+
+# source is a file path or the raw file bytes; returns the image and its metadata
+def load_image(source, kind):
+    if kind == "tif":
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with tifffile.TiffFile(source) as tif:
+            img = tif2np(tif, source)
+            tags = get_tags_from_tiff(tif, VENDOR_TAGS)
+        return img, tags
+    img, chunks = read_png(source)  # chunks = tif_tags for png
+    return img, chunks
+
+
+def render_image(
+    img,
+    tags,
+    lan,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    use_standard_sizes,
+    end_ticks=False,
+    grayscale=False,
+):
+    metadata = parse_metadata(tags)
+    img_cropped = cut_panel(img, metadata)
+    return draw_bar(
+        img_cropped,
+        metadata,
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+        grayscale,
+    )
+
+
+# output_file may be a path or a binary file object
+def save_image(result, output_file, kind, lzw_compression=True, encoder=None):
+    # encoder (see sem_scale_bar.encoders) replaces the default Pillow writers
+    if encoder is not None:
+        encoder.save(result, output_file, kind)
+    elif kind == "tif" and lzw_compression:
+        result.save(output_file, PIL_FORMATS[kind], compression="tiff_lzw")
+    else:
+        result.save(output_file, PIL_FORMATS[kind])
+
+
+PIL_FORMATS = {"tif": "TIFF", "png": "PNG"}
+
+
+def _sniff_kind(head):
+    if head.startswith(_PNG_SIGNATURE):
+        return "png"
+    if head[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"):
+        return "tif"
+    return None
+
+
+# In-memory API. Unlike process_file, errors are raised and nothing is printed
+# apart from the messages of get_scale. Both functions can be called from
+# several threads at once.
+def process_bytes(
+    source,
+    lan="English",
+    rect_color="white",
+    corner="right",
+    label="",
+    label_corner="left",
+    use_standard_sizes=False,
+    end_ticks=False,
+    grayscale=False,
+    kind=None,
+    output="bytes",
+    lzw_compression=True,
+    encoder=None,
+):
+    # source: TIFF or PNG bytes, or a seekable binary file object; bytes are
+    # read in place. kind ("tif" or "png") is detected when not given. Returns
+    # the encoded image in the same format, or an array with output="array".
+    if kind is None:
+        if hasattr(source, "read"):
+            position = source.tell()
+            head = source.read(8)
+            source.seek(position)
+        else:
+            head = bytes(source[:8])
+        kind = _sniff_kind(head)
+        if kind is None:
+            raise ValueError("not a TIFF or PNG image")
+    img, tags = load_image(source, kind)  # already converted by _native_image
+    result = render_image(
+        img,
+        tags,
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+        grayscale,
+    )
+    return _output_result(result, kind, output, lzw_compression, encoder)
+
+
+def process_array(
+    img,
+    tags,
+    lan="English",
+    rect_color="white",
+    corner="right",
+    label="",
+    label_corner="left",
+    use_standard_sizes=False,
+    end_ticks=False,
+    grayscale=False,
+    kind="tif",
+    output="bytes",
+    lzw_compression=True,
+    encoder=None,
+):
+    # img: the frame with its info panel as decoded from the file, such as
+    # tifffile's page.asarray(); it is converted as tif2np and read_png do, so
+    # pass the raw frame and not their output. tags: as get_tags_from_tiff
+    # returns them, or the PNG chunks. The array is used without copying; the
+    # result is encoded as kind, or returned as an array (output="array") or a
+    # PIL image (output="image").
+    result = render_image(
+        _native_image(np.asarray(img)),
+        tags,
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+        grayscale,
+    )
+    return _output_result(result, kind, output, lzw_compression, encoder)
+
+
+# the rendered image in the form asked for by process_bytes and process_array
+def _output_result(result, kind, output, lzw_compression, encoder):
+    if output == "image":
+        return result
+    if output == "array":
+        return np.asarray(result)
+    if output != "bytes":
+        raise ValueError(f"Unknown output: {output}")
+    buffer = io.BytesIO()
+    save_image(result, buffer, kind, lzw_compression, encoder)
+    return buffer.getvalue()
+
+
+def _timed(stats, stage, func, *args):
+    if stats is None:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        stats["stages"][stage] = time.perf_counter() - start
+
+
+# read full file path, process file (read tif metadata, cut panel, draw scale bar) and save result;
+# a stats dict, if given, is filled with per-stage times, sizes and the peak memory growth
 def process_file(
     full_file_name,
     lan,
@@ -546,21 +1237,111 @@ def process_file(
     end_ticks=False,
     lzw_compression=True,
     output_path=None,
+    large_image=False,
+    grayscale=False,
+    encoder=None,
+    stats=None,
+    previews=(),
+    stack=False,
+):
+    # previews: (size, format, quality) specs of downsized copies written next
+    # to the output, see sem_scale_bar.previews; stack: every page of a
+    # multi-page TIFF into a multi-page output, see sem_scale_bar.stack
+    if stats is None:
+        return _process_file(
+            full_file_name,
+            lan,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            k,
+            use_standard_sizes,
+            end_ticks,
+            lzw_compression,
+            output_path,
+            large_image,
+            grayscale,
+            encoder,
+            previews=previews,
+            stack=stack,
+        )
+
+    from sem_scale_bar.stats import new_record, peak_rss_kb
+
+    stats.update(new_record(full_file_name))
+    rss_before = peak_rss_kb()
+    start = time.perf_counter()
+    output_file = _process_file(
+        full_file_name,
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        k,
+        use_standard_sizes,
+        end_ticks,
+        lzw_compression,
+        output_path,
+        large_image,
+        grayscale,
+        encoder,
+        stats,
+        previews,
+        stack,
+    )
+    stats["seconds"] = time.perf_counter() - start
+    if rss_before is not None:
+        stats["peak_rss_delta_kb"] = peak_rss_kb() - rss_before
+    with contextlib.suppress(OSError):
+        stats["bytes_read"] = os.path.getsize(full_file_name)
+    if output_file:
+        stats["ok"] = True
+        stats["output"] = output_file
+        stats["bytes_written"] = os.path.getsize(output_file)
+    return output_file
+
+
+def _process_file(
+    full_file_name,
+    lan,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    k,
+    use_standard_sizes,
+    end_ticks,
+    lzw_compression,
+    output_path,
+    large_image,
+    grayscale,
+    encoder=None,
+    stats=None,
+    previews=(),
+    stack=False,
 ):
     folder, filename_ext = os.path.split(full_file_name)
     short_file_name, extension = os.path.splitext(filename_ext)
     _, extension = extension.split(".")
     if output_path:
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    if extension == "tif" or extension == "TIF" or extension == "tiff":
-        try:
-            tif = tifffile.TiffFile(full_file_name)
-            img = tif2np(tif, full_file_name)
-            tif_tags = get_tags_from_tiff(tif)
-            img_cropped = cut_panel(img, tif_tags)
-            result = draw_bar(
-                img_cropped,
-                tif_tags,
+    kind = image_kind(extension)
+    if kind is None:
+        print(unsupported_message(short_file_name, extension))
+        return None
+    try:
+        output_file = output_file_name(full_file_name, k, output_path)
+        if stack and kind == "tif":
+            from sem_scale_bar.stack import process_stack
+
+            if _timed(
+                stats,
+                "stack",
+                process_stack,
+                full_file_name,
+                output_file,
                 lan,
                 rect_color,
                 corner,
@@ -568,29 +1349,24 @@ def process_file(
                 label_corner,
                 use_standard_sizes,
                 end_ticks,
-            )
-            if output_path:
-                if lzw_compression:
-                    result.save(output_path, compression="tiff_lzw")
-                else:
-                    result.save(output_path)
-            else:
-                output_file = f"{folder}/{short_file_name}_cut_{k}.{extension}"
-                if lzw_compression:
-                    result.save(output_file, compression="tiff_lzw")
-                else:
-                    result.save(output_file)
-        except:
-            print("Error during procession ", full_file_name, ".")
-
-    elif extension == "png" or extension == "PNG":
-        try:
-            img = png2np(full_file_name)
-            chunks = extract_png_chunks(full_file_name)  # = tif_tags for png
-            img_cropped = cut_panel(img, chunks)
-            result = draw_bar(
-                img_cropped,
-                chunks,
+                lzw_compression,
+                grayscale,
+                encoder,
+                previews,
+            ):
+                if stats is not None:
+                    with tifffile.TiffFile(full_file_name) as tif:
+                        stats["height"], stats["width"] = tif.pages[0].shape[:2]
+                return output_file
+        if large_image and kind == "tif":
+            from sem_scale_bar.large_image import process_large_tiff
+
+            if _timed(
+                stats,
+                "large_image",
+                process_large_tiff,
+                full_file_name,
+                output_file,
                 lan,
                 rect_color,
                 corner,
@@ -598,18 +1374,68 @@ def process_file(
                 label_corner,
                 use_standard_sizes,
                 end_ticks,
-            )
-            if output_path:
-                result.save(output_path)
-            else:
-                result.save(f"{folder}/{short_file_name}_cut_{k}.{extension}")
-        except:
-            print("Error during procession ", full_file_name, ".")
-
-    else:
-        print(
-            "File ",
-            short_file_name,
-            extension,
-            " extension isn't 'tif' ('tiff'); it can't be processed.",
+                lzw_compression,
+                grayscale,
+                encoder,
+                previews,
+            ):
+                if stats is not None:
+                    with tifffile.TiffFile(full_file_name) as tif:
+                        stats["height"], stats["width"] = tif.pages[0].shape[:2]
+                return output_file
+        img, tags = _timed(stats, "decode", load_image, full_file_name, kind)
+        if stats is not None:
+            stats["height"], stats["width"] = img.shape[:2]
+        metadata = _timed(stats, "metadata", parse_metadata, tags)
+        img_cropped = _timed(stats, "cut_panel", cut_panel, img, metadata)
+        result = _timed(
+            stats,
+            "draw_bar",
+            draw_bar,
+            img_cropped,
+            metadata,
+            lan,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            use_standard_sizes,
+            end_ticks,
+            grayscale,
         )
+        _timed(
+            stats,
+            "save",
+            save_image,
+            result,
+            output_file,
+            kind,
+            lzw_compression,
+            encoder,
+        )
+        if previews:
+            from sem_scale_bar.previews import write_previews
+
+            _timed(
+                stats,
+                "previews",
+                write_previews,
+                img_cropped,
+                metadata,
+                previews,
+                output_file,
+                (
+                    lan,
+                    rect_color,
+                    corner,
+                    label,
+                    label_corner,
+                    use_standard_sizes,
+                    end_ticks,
+                    grayscale,
+                ),
+            )
+        return output_file
+    except:
+        print(error_message(full_file_name))
+        return None
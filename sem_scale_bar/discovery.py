@@ -0,0 +1,110 @@
+import fnmatch
+import os
+import re
+
+# first bytes of the files image_kind accepts by extension
+_SIGNATURES = {
+    "tif": (b"II*\0", b"MM\0*", b"II+\0", b"MM\0+"),  # classic and BigTIFF
+    "png": (b"\x89PNG\r\n\x1a\n",),
+}
+
+
+def is_output(file_path, k):
+    # X_cut_1.tif, and X_cut_1_256.png for a preview
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return re.search(rf"_cut_{k}(_\d+)?$", stem) is not None
+
+
+def has_image_signature(file_path, kind):
+    # sidecars renamed to .tif, AppleDouble "._X.tif" files and empty files
+    # are told apart from images by their first bytes
+    try:
+        with open(file_path, "rb") as file:
+            head = file.read(8)
+    except OSError:
+        return False
+    return head.startswith(_SIGNATURES[kind])
+
+
+def _matches(relative_path, name, patterns):
+    # a pattern with a "/" is matched against the path relative to the input
+    # folder, any other one against the file or folder name
+    return any(
+        fnmatch.fnmatch(relative_path if "/" in pattern else name, pattern)
+        for pattern in patterns or ()
+    )
+
+
+def walk_images(path, include=None, exclude=None, max_depth=None, skip_dir=None):
+    # yields the os.DirEntry of every file below path with an image extension,
+    # as the folders are read: the files of a folder come before its subfolders
+    # and nothing is listed ahead. max_depth 0 keeps to path itself; excluded
+    # folders and skip_dir (an absolute path) are not entered. Links to folders
+    # are not followed, as by os.walk, so a link loop is not walked forever.
+    from sem_scale_bar.core import image_kind
+
+    pending = [(path, "", 0)]
+    while pending:
+        folder, prefix, depth = pending.pop()
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    relative_path = prefix + entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (
+                                (max_depth is None or depth < max_depth)
+                                and not _matches(relative_path, entry.name, exclude)
+                                and (
+                                    skip_dir is None
+                                    or os.path.abspath(entry.path) != skip_dir
+                                )
+                            ):
+                                subfolders.append(
+                                    (entry.path, relative_path + "/", depth + 1)
+                                )
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue  # removed or renamed while scanning
+                    if not image_kind(os.path.splitext(entry.name)[1][1:]):
+                        continue
+                    if include and not _matches(relative_path, entry.name, include):
+                        continue
+                    if not _matches(relative_path, entry.name, exclude):
+                        yield entry
+        except OSError:
+            continue
+        pending.extend(reversed(subfolders))
+
+
+def iter_images(
+    path,
+    k=None,
+    include=None,
+    exclude=None,
+    max_depth=None,
+    skip_dir=None,
+    check_signature=True,
+):
+    # image files to process below path, lazily, for a batch to start on the
+    # first ones while the tree is still being read. Files that only have an
+    # image extension, anything in skip_dir (the output folder) and, with k,
+    # the outputs of earlier runs with the same index (*_cut_<k> and their
+    # previews) are left out. A file path is passed through as it is.
+    from sem_scale_bar.core import image_kind
+
+    if not os.path.isdir(path):
+        yield path
+        return
+    if skip_dir is not None:
+        skip_dir = os.path.abspath(skip_dir)
+    for entry in walk_images(path, include, exclude, max_depth, skip_dir):
+        if k is not None and is_output(entry.name, k):
+            continue
+        kind = image_kind(os.path.splitext(entry.name)[1][1:])
+        if check_signature and not has_image_signature(entry.path, kind):
+            continue
+        yield entry.path
@@ -0,0 +1,161 @@
+# zlib strategies accepted by Pillow's PNG writer as compress_type
+PNG_STRATEGIES = {
+    "default": 0,
+    "filtered": 1,
+    "huffman": 2,
+    "rle": 3,
+    "fixed": 4,
+}
+
+
+# output encoders: save(image, output_file, kind) writes a rendered PIL image
+# and tiff_options() gives the compression arguments for tifffile.imwrite,
+# used by the large image mode. PNG outputs are always written by Pillow, with
+# the zlib level and strategy of the encoder.
+class PillowEncoder:
+    def __init__(self, name, tiff_compression, png_level=None, png_strategy=None):
+        self.name = name
+        self.tiff_compression = tiff_compression
+        self.png_level = png_level
+        self.png_strategy = png_strategy
+
+    def __repr__(self):
+        # stable text, it is part of the options hash of the resume journal
+        return (
+            f"{type(self).__name__}({self.name!r}, png_level={self.png_level!r}, "
+            f"png_strategy={self.png_strategy!r})"
+        )
+
+    def save(self, image, output_file, kind):
+        if kind == "tif":
+            if self.tiff_compression:
+                image.save(output_file, "TIFF", compression=self.tiff_compression)
+            else:
+                image.save(output_file, "TIFF")
+        else:
+            _save_png(image, output_file, self.png_level, self.png_strategy)
+
+    def tiff_options(self):
+        return {"compression": "lzw" if self.tiff_compression else None}
+
+
+class TifffileEncoder:
+    def __init__(
+        self,
+        name,
+        compression,
+        level=None,
+        predictor=True,
+        tile=(256, 256),
+        threads=None,
+        png_level=None,
+        png_strategy=None,
+    ):
+        self.name = name
+        self.compression = compression
+        self.level = level
+        self.predictor = predictor
+        self.tile = tile
+        self.threads = threads
+        self.png_level = png_level
+        self.png_strategy = png_strategy
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}({self.name!r}, level={self.level!r}, "
+            f"predictor={self.predictor!r}, tile={self.tile!r}, "
+            f"png_level={self.png_level!r}, png_strategy={self.png_strategy!r})"
+        )
+
+    def save(self, image, output_file, kind):
+        if kind != "tif":
+            _save_png(image, output_file, self.png_level, self.png_strategy)
+            return
+        import numpy as np
+        import tifffile
+
+        data = np.asarray(image)
+        tifffile.imwrite(
+            output_file,
+            data,
+            photometric="rgb" if data.ndim == 3 else "minisblack",
+            maxworkers=self.threads,
+            bigtiff=data.nbytes > 2**32 - 2**25,
+            **self.tiff_options(),
+        )
+
+    def tiff_options(self):
+        options = {
+            "compression": self.compression,
+            "predictor": "horizontal" if self.predictor else None,
+            "tile": self.tile,
+        }
+        if self.level is not None:
+            options["compressionargs"] = {"level": self.level}
+        return options
+
+
+def _save_png(image, output_file, level, strategy):
+    options = {}
+    if level is not None:
+        options["compress_level"] = level
+    if strategy is not None:
+        options["compress_type"] = PNG_STRATEGIES[strategy]
+    image.save(output_file, "PNG", **options)
+
+
+ENCODERS = ("lzw", "raw", "deflate", "zstd")
+# levels accepted by zlib and by zstd
+COMPRESSION_LEVELS = {"deflate": range(0, 10), "zstd": range(1, 23)}
+
+
+def tifffile_options(lzw_compression, encoder=None):
+    # compression arguments of the outputs written by tifffile (large image
+    # mode and stacks); unlike Pillow, tifffile encodes lzw and zstd only
+    # through imagecodecs, so a missing codec is reported before writing
+    options = {"compression": "lzw" if lzw_compression else None}
+    if encoder is not None:
+        options = encoder.tiff_options()
+    compression = options["compression"]
+    if compression in ("lzw", "zstd"):
+        try:
+            import imagecodecs  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                f"{compression} compression of tiled and multi-page TIFFs needs "
+                "the imagecodecs package; install it or use --encoder deflate "
+                "or --no-lzw-compression"
+            )
+    return options
+
+
+def get_encoder(name, level=None, threads=None, png_level=None, png_strategy=None):
+    # lzw and raw are the Pillow writers used so far; deflate and zstd write
+    # tiled TIFFs with the horizontal predictor and compress tiles in threads
+    if name == "lzw":
+        return PillowEncoder(name, "tiff_lzw", png_level, png_strategy)
+    if name == "raw":
+        return PillowEncoder(name, None, png_level, png_strategy)
+    if name in ("deflate", "zstd"):
+        levels = COMPRESSION_LEVELS[name]
+        if level is not None and level not in levels:
+            raise ValueError(
+                f"{name} compression level must be between {levels[0]} "
+                f"and {levels[-1]}"
+            )
+        if threads is not None and threads < 1:
+            raise ValueError("encoder threads must be at least 1")
+        if name == "zstd":
+            try:
+                import imagecodecs  # noqa: F401
+            except ImportError:
+                raise ValueError("zstd compression needs the imagecodecs package")
+        return TifffileEncoder(
+            name,
+            name,
+            level=level,
+            threads=threads,
+            png_level=png_level,
+            png_strategy=png_strategy,
+        )
+    raise ValueError(f"Unknown encoder: {name}")
@@ -1,6 +1,109 @@
+import io
 import os
+import threading
+import time
 
-from sem_scale_bar.core import build_output_path, process_file
+from sem_scale_bar.core import build_output_path
+
+PREVIEW_SIZE = 480  # longer side of the live preview, pixels
+
+
+def _batch_paths(folder, file, output_dir, k):
+    # (file path, output path) of the files to process; output_dir is None
+    # when the outputs are written next to the inputs, *_cut_<k> outputs
+    # are skipped
+    from sem_scale_bar.discovery import iter_images
+
+    if folder is not None:
+        input_root = folder
+        files = iter_images(folder, k, skip_dir=output_dir)
+    else:
+        input_root = os.path.dirname(file)
+        files = [file]
+    for file_path in files:
+        yield file_path, build_output_path(file_path, output_dir, input_root)
+
+
+def _post(window, key, value):
+    if not window.is_closed():
+        window.write_event_value(key, value)
+
+
+def _process_in_background(window, paths, file_args, file_kwargs, jobs, cancel):
+    # runs in a worker thread and processes the files in a process pool;
+    # progress goes back to the event loop as window events, with the messages
+    # of every file, since only the event loop may touch the window
+    from sem_scale_bar.batch import imap_ordered, init_worker, run_job
+
+    paths = list(paths)  # the folder walk runs here too
+    _post(window, "-BatchStart-", len(paths))
+    items = (
+        (file_path, output_path, file_args, file_kwargs, False)
+        for file_path, output_path in paths
+    )
+    try:
+        # after Cancel, the files already started are finished and reported
+        for file_path, result, messages, _ in imap_ordered(
+            run_job, items, jobs, init_worker, cancel
+        ):
+            _post(window, "-FileDone-", (file_path, result, messages))
+    finally:
+        _post(window, "-BatchDone-", cancel.is_set())
+
+
+# the selected image, decoded once, without its info panel and downsampled to
+# the preview size; render only draws the overlay again, in a few milliseconds
+class _LivePreview:
+    def __init__(self, path):
+        from sem_scale_bar.core import cut_panel, image_kind, load_image, parse_metadata
+        from sem_scale_bar.previews import downsample, preview_metadata
+
+        kind = image_kind(os.path.splitext(path)[1][1:])
+        if kind is None:
+            raise ValueError("not a TIFF or PNG image")
+        img, tags = load_image(path, kind)
+        metadata = parse_metadata(tags)
+        if metadata.vendor is None:
+            raise ValueError("unknown metadata format")
+        crop = cut_panel(img, metadata)
+        self.path = path
+        self.img = downsample(crop, PREVIEW_SIZE)
+        self.metadata = preview_metadata(
+            metadata, crop.shape[1], self.img.shape[1::-1]
+        )
+
+    def render(self, render_args):
+        from sem_scale_bar.core import draw_bar
+
+        data = io.BytesIO()
+        draw_bar(self.img, self.metadata, *render_args).save(
+            data, "PNG", compress_level=1
+        )
+        return data.getvalue()
+
+
+def _first_image(folder):
+    from sem_scale_bar.discovery import iter_images
+
+    return next(iter_images(folder), None)
+
+
+def _load_preview(window, path):
+    # worker thread: large frames take a while to decode
+    try:
+        preview = _LivePreview(path)
+    except Exception as error:
+        preview = f"No preview for {os.path.basename(path)}: {error}"
+    _post(window, "-PreviewLoaded-", (path, preview))
+
+
+def _progress_text(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    text = f"{done} of {total} files, {rate:.2f} files/s"
+    if rate and done < total:
+        minutes, seconds = divmod(round((total - done) / rate), 60)
+        text += f", about {minutes}:{seconds:02d} left"
+    return text
 
 
 def run_gui():
@@ -9,7 +112,7 @@ def run_gui():
     sg.set_options(font=("DejaVu Sans", 12))
     sg.theme("NeonYellow1")  # window colours (theme); 'NeonGreen1' is fine, also
 
-    layout = [
+    controls = [
         [sg.B("Choose folder with SEM images"), sg.B("Choose one SEM image")],
         [
             sg.Checkbox("Output to separate folder", key="-UseOutputDir-"),
@@ -34,14 +137,20 @@ def run_gui():
         ],
         [
             sg.T("Label on the image, e.g. 'a)' or 'B':"),
-            sg.Input(size=(20, 1), key="-Label-"),
+            sg.Input(size=(20, 1), key="-Label-", enable_events=True),
             sg.T("(can be empty)"),
         ],
         [
             sg.B("label: left", button_color=("orange", "gray"), tooltip="Default"),
             sg.B("label: right", button_color=(sg.theme_background_color())),
         ],
-        [sg.Checkbox("Use standard 1-2-5 bar sizes", key="-StandardSizes-")],
+        [
+            sg.Checkbox(
+                "Use standard 1-2-5 bar sizes",
+                key="-StandardSizes-",
+                enable_events=True,
+            )
+        ],
         [
             sg.Checkbox(
                 "Use LZW compression for TIFF outputs",
@@ -49,11 +158,32 @@ def run_gui():
                 default=True,
             )
         ],
-        [sg.Checkbox("Add end ticks to scale bar", key="-EndTicks-")],
-        [sg.Push(), sg.B("Process"), sg.Push()],
+        [
+            sg.Checkbox(
+                "Add end ticks to scale bar", key="-EndTicks-", enable_events=True
+            )
+        ],
+        [
+            sg.Checkbox(
+                "Save grayscale images (smaller files)",
+                key="-Grayscale-",
+                enable_events=True,
+            )
+        ],
+        [sg.Checkbox("Use all CPU cores", key="-AllCores-")],
+        [sg.Push(), sg.B("Process"), sg.B("Cancel", disabled=True), sg.Push()],
+        [
+            sg.ProgressBar(1, orientation="h", size=(30, 15), key="-Progress-"),
+            sg.T("", size=(40, 1), key="-ProgressText-"),
+        ],
         [sg.Output(size=(60, 10))],
         [sg.Push(), sg.B("Exit"), sg.Push()],
     ]
+    preview_pane = [
+        [sg.Image(key="-Preview-", size=(PREVIEW_SIZE, PREVIEW_SIZE))],
+        [sg.T("Choose an image to see a preview.", size=(50, 1), key="-PreviewText-")],
+    ]
+    layout = [[sg.Column(controls), sg.Column(preview_pane, vertical_alignment="top")]]
 
     window = sg.Window("SEM scale bar - version 4.2", layout)
 
@@ -66,6 +196,8 @@ def run_gui():
     use_output_dir = False
     lzw_compression = True
     end_ticks = False
+    grayscale = False
+    all_cores = False
 
     chosen_color = "white"
     chosen_language = "English"
@@ -77,14 +209,45 @@ def run_gui():
     file = None
     output_dir = None
 
+    preview = None  # _LivePreview of the chosen image
+    preview_wanted = None  # path being loaded
+    preview_args = None  # options of the shown preview
+    worker = None  # background batch
+    cancel = threading.Event()
+    exiting = False
+    batch_to_output_dir = False
+    total = done = 0
+    started = 0.0
+
     while True:
         event, values = window.read()
 
         if event == "Choose folder with SEM images":
             folder = sg.popup_get_folder("Select a folder", no_window=True)
+            if folder:
+                preview_wanted = _first_image(folder)
 
         if event == "Choose one SEM image":
             file = sg.popup_get_file("Select an image", no_window=True)
+            if file:
+                preview_wanted = file
+
+        if event in ("Choose folder with SEM images", "Choose one SEM image"):
+            if preview_wanted and (preview is None or preview.path != preview_wanted):
+                window["-PreviewText-"].update("Loading preview...")
+                threading.Thread(
+                    target=_load_preview, args=(window, preview_wanted), daemon=True
+                ).start()
+
+        if event == "-PreviewLoaded-":
+            path, loaded = values[event]
+            if path == preview_wanted:
+                if isinstance(loaded, str):
+                    preview = None
+                    window["-PreviewText-"].update(loaded)
+                else:
+                    preview, preview_args = loaded, None
+                    window["-PreviewText-"].update(os.path.basename(path))
 
         if event in ["white", "black", "transparent"]:
             rect_color = event
@@ -134,6 +297,14 @@ def run_gui():
             end_ticks = values["-EndTicks-"]
         except Exception:
             pass
+        try:
+            grayscale = values["-Grayscale-"]
+        except Exception:
+            pass
+        try:
+            all_cores = values["-AllCores-"]
+        except Exception:
+            pass
         try:
             use_output_dir = values["-UseOutputDir-"]
         except Exception:
@@ -143,73 +314,117 @@ def run_gui():
         except Exception:
             pass
 
-        if event == "Process":
+        # only the overlay is drawn again when an option changes
+        render_args = (
+            language,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            use_standard_sizes,
+            end_ticks,
+            grayscale,
+        )
+        if preview is not None and render_args != preview_args:
+            try:
+                window["-Preview-"].update(data=preview.render(render_args))
+            except Exception as error:
+                window["-PreviewText-"].update(f"No preview: {error}")
+            preview_args = render_args
+
+        if event == "Process" and worker is None:
             if use_output_dir and not output_dir:
                 print("Choose an output folder or disable the output option.")
                 window.refresh()
                 continue
-            if folder is not None:
-                input_root = folder
-                for root, _, files in os.walk(folder):
-                    for file_name in files:
-                        full_file_name = os.path.join(root, file_name)
-                        output_path = (
-                            build_output_path(
-                                full_file_name, output_dir, input_root
-                            )
-                            if use_output_dir
-                            else None
-                        )
-                        process_file(
-                            full_file_name,
-                            language,
-                            rect_color,
-                            corner,
-                            label,
-                            label_corner,
-                            k,
-                            use_standard_sizes,
-                            end_ticks,
-                            lzw_compression,
-                            output_path=output_path,
-                        )
-                k += 1
-                folder = None
-                if use_output_dir:
-                    print("Process is complete. Check output folder.")
-                else:
-                    print("Process is complete. Check initial folder.")
-            elif file is not None:
-                input_root = os.path.dirname(file)
-                output_path = (
-                    build_output_path(file, output_dir, input_root)
-                    if use_output_dir
-                    else None
-                )
-                process_file(
-                    file,
-                    language,
-                    rect_color,
-                    corner,
-                    label,
-                    label_corner,
-                    k,
-                    use_standard_sizes,
-                    end_ticks,
-                    lzw_compression,
-                    output_path=output_path,
-                )
-                k += 1
-                file = None
-                if use_output_dir:
-                    print("Process is complete. Check output folder.")
-                else:
-                    print("Process is complete. Check initial folder.")
-            else:
+            if folder is None and file is None:
                 print("Choose folder or image.")
-            window.refresh()
+                window.refresh()
+                continue
+            from sem_scale_bar.batch import resolve_jobs
+
+            paths = _batch_paths(
+                folder, file, output_dir if use_output_dir else None, k
+            )
+            file_args = (
+                language,
+                rect_color,
+                corner,
+                label,
+                label_corner,
+                k,
+                use_standard_sizes,
+                end_ticks,
+                lzw_compression,
+            )
+            cancel.clear()
+            worker = threading.Thread(
+                target=_process_in_background,
+                args=(
+                    window,
+                    paths,
+                    file_args,
+                    {"grayscale": grayscale},
+                    resolve_jobs("auto" if all_cores else 1),
+                    cancel,
+                ),
+                daemon=True,
+            )
+            worker.start()
+            batch_to_output_dir = use_output_dir
+            k += 1
+            folder = None
+            file = None
+            window["Process"].update(disabled=True)
+            window["Cancel"].update(disabled=False)
+            window["-ProgressText-"].update("Listing files...")
+
+        if event == "Cancel" and worker is not None:
+            cancel.set()
+            window["Cancel"].update(disabled=True)
+            print("Stopping after the current file...")
+
+        if event == "-BatchStart-":
+            total, done = values[event], 0
+            started = time.perf_counter()
+            window["-Progress-"].update(current_count=0, max=max(total, 1))
+            window["-ProgressText-"].update(_progress_text(0, total, 0))
+
+        if event == "-FileDone-":
+            _, _, messages = values[event]
+            if messages:
+                print(messages, end="")
+            done += 1
+            window["-Progress-"].update(current_count=done)
+            window["-ProgressText-"].update(
+                _progress_text(done, total, time.perf_counter() - started)
+            )
+
+        if event == "-BatchDone-":
+            worker.join()
+            worker = None
+            window["Process"].update(disabled=False)
+            window["Cancel"].update(disabled=True)
+            if values[event]:
+                print(f"Process is cancelled after {done} of {total} files.")
+            elif batch_to_output_dir:
+                print("Process is complete. Check output folder.")
+            else:
+                print("Process is complete. Check initial folder.")
+            if exiting:
+                break
+
+        if event == "Exit" and worker is not None:
+            # let the current file finish, then close
+            exiting = True
+            cancel.set()
+            print("Stopping after the current file...")
+            continue
 
         if event == sg.WIN_CLOSED or event == "Exit":
             break
 
+    cancel.set()
     window.close()
+    if worker is not None:
+        worker.join()
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+
+JOURNAL_NAME = ".sem_scale_bar_journal.jsonl"
+
+
+def default_journal_path(input_root, output_dir=None):
+    return os.path.join(output_dir or input_root, JOURNAL_NAME)
+
+
+def options_key(file_args, file_kwargs=None):
+    options = [list(file_args), sorted((file_kwargs or {}).items())]
+    return hashlib.sha1(json.dumps(options, default=str).encode()).hexdigest()
+
+
+def load_entries(path):
+    # the last line written for a file wins; a line cut short by a crash is ignored
+    entries = {}
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    entries[entry["input"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+# append-only record of finished files: input path, size, mtime, options hash
+# and output path; a file counts as done while all of them still match
+class Journal:
+    def __init__(self, path, options):
+        self.path = os.path.abspath(path)
+        self.options = options
+        self.entries = load_entries(self.path)
+        self._file = None
+
+    def is_done(self, file_path):
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is None or entry.get("options") != self.options:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return (
+            entry.get("size") == stat.st_size
+            and entry.get("mtime") == stat.st_mtime_ns
+            and os.path.exists(entry.get("output", ""))
+        )
+
+    def record(self, file_path, output_file):
+        stat = os.stat(file_path)
+        entry = {
+            "input": os.path.abspath(file_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "options": self.options,
+            "output": os.path.abspath(output_file),
+        }
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries[entry["input"]] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import tifffile
+
+from sem_scale_bar.core import (
+    VENDOR_TAGS,
+    _LUT_16_TO_8,
+    _overlay_template,
+    _render_patches,
+    cut_panel,
+    get_scale,
+    get_tags_from_tiff,
+    parse_metadata,
+)
+from sem_scale_bar.encoders import tifffile_options
+
+TILE_SIZE = 256
+
+
+def _frame_converter(img):
+    # same 8-bit values as tif2np followed by draw_bar, applied per tile
+    if img.dtype == np.uint8:
+        return np.asarray
+    if img.max() > 255:
+        return lambda block: _LUT_16_TO_8[block]
+    return lambda block: np.asarray(block, dtype=np.uint8)
+
+
+def _iter_tiles(crop, patches, to_8bit, grayscale=False):
+    height, width = crop.shape
+    for top in range(0, height, TILE_SIZE):
+        bottom = min(height, top + TILE_SIZE)
+        for left in range(0, width, TILE_SIZE):
+            right = min(width, left + TILE_SIZE)
+            block = to_8bit(crop[top:bottom, left:right])
+            if grayscale:
+                tile = np.array(block)  # writable copy of the mapped pixels
+            else:
+                tile = np.repeat(block[:, :, None], 3, axis=2)
+            for patch_left, patch_top, patch in patches:
+                x0 = max(left, patch_left)
+                x1 = min(right, patch_left + patch.shape[1])
+                y0 = max(top, patch_top)
+                y1 = min(bottom, patch_top + patch.shape[0])
+                if x0 < x1 and y0 < y1:
+                    tile[y0 - top : y1 - top, x0 - left : x1 - left] = patch[
+                        y0 - patch_top : y1 - patch_top,
+                        x0 - patch_left : x1 - patch_left,
+                    ]
+            yield tile
+
+
+# the frame is memory-mapped (uncompressed pages directly, compressed or tiled
+# pages through a temporary file), the panel is cropped as a view, the overlay
+# is drawn on corner patches only and the output is written tile by tile;
+# returns False if the page is not a single-channel 8/16-bit image
+def process_large_tiff(
+    full_file_name,
+    output_file,
+    lan,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    use_standard_sizes,
+    end_ticks=False,
+    lzw_compression=True,
+    grayscale=False,
+    encoder=None,
+    previews=(),
+):
+    with tifffile.TiffFile(full_file_name) as tif:
+        page = tif.pages[0]
+        if len(page.shape) != 2 or page.dtype not in (np.uint8, np.uint16):
+            return False
+        options = tifffile_options(lzw_compression, encoder)
+        metadata = parse_metadata(get_tags_from_tiff(tif, VENDOR_TAGS))
+        img = page.asarray(out="memmap")
+        to_8bit = _frame_converter(img)
+        crop = cut_panel(img, metadata)
+        mode = "L" if grayscale else "RGB"
+        overlay = _overlay_template(
+            crop.shape[1],
+            crop.shape[0],
+            get_scale(metadata),
+            lan,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            use_standard_sizes,
+            end_ticks,
+            mode,
+        )
+        patches = [
+            (left, top, np.asarray(patch))
+            for left, top, patch in _render_patches(crop, overlay, to_8bit, mode)
+        ]
+        height, width = crop.shape
+        shape = (height, width) if grayscale else (height, width, 3)
+        options["tile"] = (TILE_SIZE, TILE_SIZE)  # _iter_tiles yields this size
+        try:
+            tifffile.imwrite(
+                output_file,
+                _iter_tiles(crop, patches, to_8bit, grayscale),
+                shape=shape,
+                dtype=np.uint8,
+                photometric="minisblack" if grayscale else "rgb",
+                bigtiff=int(np.prod(shape)) > 2**32 - 2**25,
+                **options,
+            )
+        except BaseException:
+            # no truncated output is left behind
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+        if previews:
+            from sem_scale_bar.previews import write_previews
+
+            render_args = (
+                lan,
+                rect_color,
+                corner,
+                label,
+                label_corner,
+                use_standard_sizes,
+                end_ticks,
+                grayscale,
+            )
+            write_previews(crop, metadata, previews, output_file, render_args, to_8bit)
+    return True
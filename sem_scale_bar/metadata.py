@@ -0,0 +1,110 @@
+import os
+import struct
+
+# the only definition; core imports it, so the two PNG readers agree
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+INSPECT_FIELDS = (
+    "path",
+    "vendor",
+    "pixel_size_um",
+    "strip_height",
+    "width",
+    "height",
+    "error",
+)
+
+
+def read_png_metadata(filename):
+    # walk the chunk headers and seek over the pixel data; the chunk list has
+    # the same layout as core.extract_png_chunks with empty IDAT payloads
+    chunks = []
+    width = height = None
+    with open(filename, "rb") as file:
+        if file.read(8) != _PNG_SIGNATURE:
+            raise ValueError("not a PNG file")
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"IDAT":
+                file.seek(length + 4, os.SEEK_CUR)
+                chunks.append((chunk_type, b""))
+                continue
+            chunk_data = file.read(length)
+            file.seek(4, os.SEEK_CUR)  # crc
+            chunks.append((chunk_type, chunk_data))
+            if chunk_type == b"IHDR":
+                width, height = struct.unpack(">II", chunk_data[:8])
+            elif chunk_type == b"IEND":
+                break
+    return chunks, width, height
+
+
+def read_tiff_metadata(filename):
+    import tifffile
+
+    from sem_scale_bar.core import VENDOR_TAGS, get_tags_from_tiff
+
+    with tifffile.TiffFile(filename) as tif:
+        tags = get_tags_from_tiff(tif, VENDOR_TAGS)
+    return tags, tags.get("ImageWidth"), tags.get("ImageLength")
+
+
+def get_vendor(tags):
+    from sem_scale_bar.core import detect_vendor
+
+    return detect_vendor(tags) or "unknown"
+
+
+def inspect_file(filename):
+    from sem_scale_bar.core import image_kind, parse_metadata
+
+    record = dict.fromkeys(INSPECT_FIELDS)
+    record["path"] = filename
+    kind = image_kind(os.path.splitext(filename)[1][1:])
+    try:
+        if kind == "tif":
+            tags, width, height = read_tiff_metadata(filename)
+        elif kind == "png":
+            tags, width, height = read_png_metadata(filename)
+        else:
+            record["error"] = "unsupported extension"
+            return record
+        record["vendor"] = get_vendor(tags)
+        record["width"] = width
+        record["height"] = height
+        metadata = parse_metadata(tags)
+        record["pixel_size_um"] = metadata.pixel_size or None
+        record["strip_height"] = metadata.strip_height
+    except Exception as error:
+        record["error"] = str(error) or type(error).__name__
+    return record
+
+
+def _inspect_chunk(filenames):
+    return [inspect_file(filename) for filename in filenames]
+
+
+def iter_inspect(paths, jobs=1, chunk_size=64):
+    # files are sent to the workers in chunks to keep the per-file overhead low
+    if jobs <= 1:
+        for filename in paths:
+            yield inspect_file(filename)
+        return
+
+    from sem_scale_bar.batch import imap_ordered
+
+    def chunks():
+        chunk = []
+        for filename in paths:
+            chunk.append(filename)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    for records in imap_ordered(_inspect_chunk, chunks(), jobs):
+        yield from records
@@ -0,0 +1,198 @@
+import os
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+def _settings(file_args, file_kwargs):
+    if file_kwargs.get("large_image"):
+        raise ValueError("large images are not supported by the pipeline")
+    if file_kwargs.get("stack"):
+        raise ValueError("TIFF stacks are not supported by the pipeline")
+    (
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        k,
+        use_standard_sizes,
+        end_ticks,
+        lzw_compression,
+    ) = file_args
+    return {
+        "k": k,
+        "render_args": (
+            lan,
+            rect_color,
+            corner,
+            label,
+            label_corner,
+            use_standard_sizes,
+            end_ticks,
+            file_kwargs.get("grayscale", False),
+        ),
+        "lzw_compression": lzw_compression,
+        "encoder": file_kwargs.get("encoder"),
+        "previews": file_kwargs.get("previews", ()),
+    }
+
+
+def _read_stage(job, settings):
+    from sem_scale_bar.core import image_kind, output_file_name, unsupported_message
+
+    file_path, output_path = job["path"], job["output_path"]
+    short_file_name, extension = os.path.splitext(os.path.basename(file_path))
+    _, extension = extension.split(".")
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    job["kind"] = image_kind(extension)
+    if job["kind"] is None:
+        job["message"] = unsupported_message(short_file_name, extension)
+        return
+    job["output_file"] = output_file_name(file_path, settings["k"], output_path)
+    with open(file_path, "rb") as file:
+        job["data"] = file.read()
+    if "stats" in job:
+        job["stats"]["bytes_read"] = len(job["data"])
+
+
+def _decode_stage(job, settings):
+    from sem_scale_bar.core import load_image
+
+    job["img"], job["tags"] = load_image(job.pop("data"), job["kind"])
+    if "stats" in job:
+        job["stats"]["height"], job["stats"]["width"] = job["img"].shape[:2]
+
+
+def _render_stage(job, settings):
+    from sem_scale_bar.core import render_image
+
+    if not settings["previews"]:
+        job["result"] = render_image(
+            job.pop("img"), job.pop("tags"), *settings["render_args"]
+        )
+        return
+
+    from sem_scale_bar.core import cut_panel, draw_bar, parse_metadata
+    from sem_scale_bar.previews import render_previews
+
+    metadata = parse_metadata(job.pop("tags"))
+    crop = cut_panel(job.pop("img"), metadata)
+    job["result"] = draw_bar(crop, metadata, *settings["render_args"])
+    job["previews"] = render_previews(
+        crop,
+        metadata,
+        settings["previews"],
+        job["output_file"],
+        settings["render_args"],
+    )
+
+
+def _encode_stage(job, settings):
+    from sem_scale_bar.core import save_image
+
+    save_image(
+        job.pop("result"),
+        job["output_file"],
+        job["kind"],
+        settings["lzw_compression"],
+        settings["encoder"],
+    )
+    if "previews" in job:
+        from sem_scale_bar.previews import save_preview
+
+        for preview in job.pop("previews"):
+            save_preview(*preview)
+    if "stats" in job:
+        job["stats"]["bytes_written"] = os.path.getsize(job["output_file"])
+
+
+def _run_stage(stage, settings, inbox, outbox):
+    from sem_scale_bar.stats import peak_rss_kb
+
+    while True:
+        job = inbox.get()
+        if job is _DONE:
+            outbox.put(_DONE)
+            return
+        if job["message"] is None:
+            if "stats" in job and "started" not in job:
+                job["started"] = time.perf_counter()
+                job["rss_before"] = peak_rss_kb()
+            start = time.perf_counter()
+            try:
+                stage(job, settings)
+                if "stats" in job:
+                    name = stage.__name__[1:-6]  # _read_stage -> read
+                    job["stats"]["stages"][name] = time.perf_counter() - start
+            except Exception:
+                from sem_scale_bar.core import error_message
+
+                job["message"] = error_message(job["path"])
+                for key in ("data", "img", "tags", "result", "previews"):
+                    job.pop(key, None)
+            if "stats" in job:
+                job["finished"] = time.perf_counter()
+                job["rss_after"] = peak_rss_kb()
+        outbox.put(job)
+
+
+def _feed(paths, outbox, stats):
+    from sem_scale_bar.stats import new_record
+
+    try:
+        for file_path, output_path in paths:
+            job = {
+                "path": file_path,
+                "output_path": output_path,
+                "message": None,
+            }
+            if stats:
+                job["stats"] = new_record(file_path)
+            outbox.put(job)
+    finally:
+        outbox.put(_DONE)
+
+
+def iter_pipeline(paths, file_args, file_kwargs=None, queue_depth=2, stats=False):
+    # read -> decode -> render -> encode, one thread per stage; the bounded
+    # queues cap the number of files held in memory between two stages
+    settings = _settings(file_args, file_kwargs or {})
+    stages = (_read_stage, _decode_stage, _render_stage, _encode_stage)
+    queues = [
+        queue.Queue(maxsize=max(1, queue_depth)) for _ in range(len(stages) + 1)
+    ]
+    threads = [
+        threading.Thread(target=_feed, args=(paths, queues[0], stats), daemon=True)
+    ]
+    for index, stage in enumerate(stages):
+        threads.append(
+            threading.Thread(
+                target=_run_stage,
+                args=(stage, settings, queues[index], queues[index + 1]),
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+    while True:
+        job = queues[-1].get()
+        if job is _DONE:
+            break
+        if "stats" in job:
+            # wall time from the start of reading to the end of the last stage,
+            # waits between stages included, as process_file measures it
+            record = job["stats"]
+            if "started" in job:
+                record["seconds"] = job["finished"] - job["started"]
+                if job["rss_before"] is not None:
+                    record["peak_rss_delta_kb"] = job["rss_after"] - job["rss_before"]
+            if job["message"] is None:
+                record["ok"] = True
+                record["output"] = job["output_file"]
+        yield job
+    for thread in threads:
+        thread.join()
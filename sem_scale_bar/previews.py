@@ -0,0 +1,150 @@
+import os
+
+# format name -> (Pillow format, file extension)
+PREVIEW_FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "jpg": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+    "tif": ("TIFF", "tif"),
+}
+_QUALITY_FORMATS = ("JPEG", "WEBP")
+
+
+def parse_preview(text):
+    # "SIZE[:FORMAT[:QUALITY]]" -> (size, format, quality); size is the longer
+    # side in pixels, the format defaults to jpeg and quality to Pillow's
+    parts = text.split(":")
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"invalid preview: {text!r}, expected SIZE[:FORMAT[:QUALITY]]")
+    try:
+        size = int(parts[0])
+    except ValueError:
+        raise ValueError(f"invalid preview size: {parts[0]!r}")
+    if size < 1:
+        raise ValueError("preview size must be at least 1")
+    format_name = parts[1].lower() if len(parts) > 1 and parts[1] else "jpeg"
+    if format_name not in PREVIEW_FORMATS:
+        raise ValueError(
+            f"unknown preview format: {parts[1]!r}, "
+            f"expected one of {', '.join(PREVIEW_FORMATS)}"
+        )
+    quality = None
+    if len(parts) == 3 and parts[2]:
+        try:
+            quality = int(parts[2])
+        except ValueError:
+            raise ValueError(f"invalid preview quality: {parts[2]!r}")
+        if not 1 <= quality <= 100:
+            raise ValueError("preview quality must be between 1 and 100")
+    return size, format_name, quality
+
+
+def preview_path(output_file, size, format_name):
+    root, _ = os.path.splitext(output_file)
+    return f"{root}_{size}.{PREVIEW_FORMATS[format_name][1]}"
+
+
+def _reduce(img, factor, to_8bit, band_rows=1024):
+    # mean of factor x factor blocks; bands of rows are reduced one at a time
+    # so memory mapped frames are never converted whole
+    import numpy as np
+    from PIL import Image
+
+    band = factor * max(1, band_rows // factor)
+    return np.vstack(
+        [
+            np.asarray(Image.fromarray(to_8bit(img[top : top + band])).reduce(factor))
+            for top in range(0, img.shape[0], band)
+        ]
+    )
+
+
+def _target_size(shape, size):
+    # (width, height) with the longer side at most size, never enlarged
+    height, width = shape[:2]
+    scale = min(1.0, size / max(height, width))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _shrink(img, convert, size, target):
+    # integer block means first (cheap), then a box resize to the exact size;
+    # returns the 8-bit (or float) image of target size
+    import numpy as np
+    from PIL import Image
+
+    factor = max(1, max(img.shape[:2]) // size)
+    if factor > 1:
+        small = _reduce(img, factor, convert)
+    else:
+        small = np.asarray(convert(img))
+    if small.shape[1::-1] != target:
+        small = np.asarray(Image.fromarray(small).resize(target, Image.BOX))
+    return small
+
+
+def downsample(img, size, to_8bit=None):
+    # area average of img, size pixels on the longer side, as draw_bar takes it
+    from sem_scale_bar.core import _to_8bit
+
+    return _shrink(img, to_8bit or _to_8bit, size, _target_size(img.shape, size))
+
+
+def preview_metadata(metadata, width, preview_size):
+    # metadata of a frame width pixels wide, shrunk to preview_size (w, h)
+    from sem_scale_bar.core import ImageMetadata, parse_metadata
+
+    metadata = parse_metadata(metadata)
+    return ImageMetadata(
+        metadata.vendor,
+        metadata.kind,
+        metadata.pixel_size * width / preview_size[0],
+        metadata.strip_height,
+        *preview_size,
+    )
+
+
+def render_previews(crop, metadata, previews, output_file, render_args, to_8bit=None):
+    # crop: the frame without its info panel, as draw_bar takes it; every
+    # preview is area-averaged from it, whatever other sizes are asked for, and
+    # gets its own overlay drawn at the preview size, so the texts keep a
+    # readable size. Returns [(path, image, format, quality)], largest first.
+    from sem_scale_bar.core import _to_8bit, draw_bar
+
+    width = crop.shape[1]
+    convert = to_8bit or _to_8bit
+    rendered = []
+    for size, format_name, quality in sorted(
+        previews, key=lambda preview: preview[0], reverse=True
+    ):
+        target = _target_size(crop.shape, size)
+        small = _shrink(crop, convert, size, target)
+        rendered.append(
+            (
+                preview_path(output_file, size, format_name),
+                draw_bar(
+                    small, preview_metadata(metadata, width, target), *render_args
+                ),
+                format_name,
+                quality,
+            )
+        )
+    return rendered
+
+
+def save_preview(path, image, format_name, quality=None):
+    pil_format = PREVIEW_FORMATS[format_name][0]
+    if quality is not None and pil_format in _QUALITY_FORMATS:
+        image.save(path, pil_format, quality=quality)
+    else:
+        image.save(path, pil_format)
+
+
+def write_previews(crop, metadata, previews, output_file, render_args, to_8bit=None):
+    paths = []
+    for path, image, format_name, quality in render_previews(
+        crop, metadata, previews, output_file, render_args, to_8bit
+    ):
+        save_preview(path, image, format_name, quality)
+        paths.append(path)
+    return paths
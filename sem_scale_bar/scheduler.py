@@ -0,0 +1,115 @@
+import bisect
+import math
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+BASE_MEMORY = 16 * 2**20  # per file, besides the pixel buffers
+TILE_ROW_BYTES = 24  # per pixel of a row of tiles in the large image mode
+_SIZE_UNITS = {"": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+_PNG_SAMPLES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # by color type
+
+
+def parse_size(text):
+    # "512M", "16G", "2.5GB" or a number of bytes -> bytes
+    value = text.strip().lower()
+    if value.endswith("b"):
+        value = value[:-1]
+    unit = value[-1:] if value[-1:] in _SIZE_UNITS else ""
+    try:
+        size = float(value[: len(value) - len(unit)]) * _SIZE_UNITS[unit]
+    except ValueError:
+        raise ValueError(f"invalid size: {text!r}")
+    if not math.isfinite(size):  # inf, nan, 1e400
+        raise ValueError(f"invalid size: {text!r}")
+    if size <= 0:
+        raise ValueError("size must be positive")
+    return int(size)
+
+
+def _image_header(file_path, kind):
+    # (height, width, samples, bytes per sample, memory-mappable 2-D page)
+    if kind == "tif":
+        import tifffile
+
+        with tifffile.TiffFile(file_path) as tif:
+            page = tif.pages.first
+            mappable = (
+                page.compression == 1
+                and page.samplesperpixel == 1
+                and page.dtype is not None
+                and page.dtype.itemsize <= 2
+            )
+            return (
+                page.imagelength,
+                page.imagewidth,
+                page.samplesperpixel,
+                page.bitspersample // 8 or 1,
+                mappable,
+            )
+    with open(file_path, "rb") as file:
+        header = file.read(26)
+    width, height, bitdepth, color_type = struct.unpack(">IIBB", header[16:26])
+    samples = _PNG_SAMPLES.get(color_type, 4)
+    return height, width, samples, 2 if bitdepth == 16 else 1, False
+
+
+def estimate_memory(file_path, large_image=False, grayscale=False):
+    # peak memory of processing file_path, from its header only: the decoded
+    # frame with its decode buffers, the 8-bit copy and the result image with
+    # its encode buffer (measured on the LZW and raw TIFF writers)
+    from sem_scale_bar.core import image_kind
+
+    kind = image_kind(os.path.splitext(file_path)[1][1:])
+    if kind is None:
+        return 0
+    try:
+        height, width, samples, itemsize, mappable = _image_header(file_path, kind)
+    except Exception:  # unreadable files fail quickly
+        return BASE_MEMORY
+    if large_image and mappable:
+        from sem_scale_bar.large_image import TILE_SIZE
+
+        return BASE_MEMORY + width * TILE_SIZE * TILE_ROW_BYTES
+    pixels = height * width
+    per_pixel = samples * itemsize * 5 // 2 + 1 + (1 if grayscale else 3)
+    if samples > 1:
+        per_pixel += 8  # averaged to one channel in float64
+    return BASE_MEMORY + pixels * per_pixel
+
+
+def imap_budgeted(func, items, estimates, jobs, budget, initializer=None):
+    # items are started largest estimate first, each time the largest one that
+    # fits next to the running ones (first fit decreasing), so that the sum of
+    # the running estimates stays under budget; when nothing runs the largest
+    # item starts, alone if it is larger than budget. Results come back in the
+    # order of items, whatever order they finish in.
+    order = sorted(range(len(items)), key=estimates.__getitem__)
+    sizes = [estimates[index] for index in order]
+    futures = [None] * len(items)
+    next_result = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        running = {}
+        in_use = 0
+        while order or running:
+            while order and len(running) < jobs:
+                if running:
+                    position = bisect.bisect_right(sizes, budget - in_use) - 1
+                    if position < 0:
+                        break
+                else:
+                    position = len(sizes) - 1
+                index = order.pop(position)
+                future = executor.submit(func, items[index])
+                futures[index] = future
+                running[future] = sizes.pop(position)
+                in_use += running[future]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_use -= running.pop(future)
+            while next_result < len(items) and futures[next_result] is not None:
+                if not futures[next_result].done():
+                    break
+                yield futures[next_result].result()
+                futures[next_result] = None  # the result is not kept
+                next_result += 1
@@ -0,0 +1,384 @@
+import argparse
+import functools
+import hmac
+import itertools
+import json
+import os
+import secrets
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+KEEP_FINISHED = 1000  # finished jobs kept for status requests
+
+# options of a whole CLI run that have no meaning for a single server job
+_RUN_OPTIONS = {
+    "watch": "--watch",
+    "resume": "--resume",
+    "force": "--force",
+    "journal": "--journal",
+    "stats": "--stats",
+    "pipeline": "--pipeline",
+    "memory_budget": "--memory-budget",
+}
+
+
+def _raise_error(message):
+    raise ValueError(message)
+
+
+def parse_job(path, options):
+    # the CLI parser checks the options; returns the files to process
+    # as (path, output path) and the process_file arguments
+    if not isinstance(options, list) or not all(
+        isinstance(option, str) for option in options
+    ):
+        raise ValueError("options must be a list of strings")
+    from sem_scale_bar.cli import build_parser, file_options
+    from sem_scale_bar.core import build_output_path
+    from sem_scale_bar.discovery import iter_images
+
+    parser = build_parser()
+    parser.error = _raise_error
+    try:
+        # the path first, so an option missing its value cannot take it
+        args = parser.parse_args([path] + options)
+    except SystemExit:  # --help
+        raise ValueError("invalid options")
+    if not os.path.exists(args.input):
+        raise ValueError(f"Input path not found: {args.input}")
+    if args.output_dir and not os.path.isabs(args.output_dir):
+        # it would be relative to the folder the server was started in
+        raise ValueError("--output-dir must be an absolute path")
+    for dest, option in _RUN_OPTIONS.items():
+        if getattr(args, dest):
+            raise ValueError(f"{option} is not supported by the server")
+    if args.jobs != 1:
+        raise ValueError(
+            "--jobs is not supported by the server; its files run on the "
+            "workers of serve --jobs"
+        )
+    file_args, file_kwargs = file_options(args, parser)
+    input_root = path if os.path.isdir(path) else os.path.dirname(path)
+    files = [
+        (file_path, build_output_path(file_path, args.output_dir, input_root))
+        for file_path in iter_images(
+            path,
+            args.output_index,
+            args.include,
+            args.exclude,
+            args.max_depth,
+            skip_dir=args.output_dir,
+        )
+    ]
+    return files, file_args, file_kwargs
+
+
+# jobs share one warm process pool, files are processed in submission order
+class JobQueue:
+    def __init__(self, jobs):
+        self.workers = jobs
+        self.executor = self._new_executor()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self._ids = itertools.count(1)
+
+    def _new_executor(self):
+        # the workers ignore Ctrl+C, the server finishes their files on exit
+        from sem_scale_bar.batch import init_worker
+
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker, initargs=(True,)
+        )
+
+    def submit(self, path, options):
+        from sem_scale_bar.batch import run_job
+
+        path = os.path.abspath(path)
+        files, file_args, file_kwargs = parse_job(path, options)
+        with self.lock:
+            job = {
+                "id": next(self._ids),
+                "path": path,
+                "options": list(options),
+                "submitted": time.time(),
+                "finished": None,
+                "total": len(files),
+                "processed": 0,
+                "failed": 0,
+                "files": [
+                    {
+                        "path": file_path,
+                        "state": "queued",
+                        "output": None,
+                        "seconds": None,
+                        "messages": "",
+                    }
+                    for file_path, _ in files
+                ],
+                "futures": [],
+                "event": threading.Event(),
+            }
+            if not files:
+                job["finished"] = job["submitted"]
+                job["event"].set()
+            self.jobs[job["id"]] = job
+            self._prune()
+        executor = self.executor
+        try:
+            for index, (file_path, output_path) in enumerate(files):
+                future = executor.submit(
+                    run_job, (file_path, output_path, file_args, file_kwargs, True)
+                )
+                job["futures"].append(future)
+                future.add_done_callback(
+                    functools.partial(self._file_done, job, index)
+                )
+        except (BrokenProcessPool, RuntimeError) as error:
+            self._restart(executor, job, error)
+            raise
+        return self.status(job["id"])
+
+    def _restart(self, executor, job, error):
+        # a worker died (killed for memory, a crash in a codec) and took the
+        # pool down: the files of job not submitted yet fail, and later jobs
+        # go to a new pool; files already submitted fail in _file_done
+        with self.lock:
+            if self.executor is executor:
+                self.executor = self._new_executor()
+            for file in job["files"][len(job["futures"]) :]:
+                file.update(state="failed", messages=f"{error}\n")
+                job["failed"] += 1
+            self._finish(job)
+        executor.shutdown(wait=False)
+
+    def _file_done(self, job, index, future):
+        try:
+            _, result, messages, record = future.result()
+        except Exception as error:
+            result, messages, record = None, f"{error}\n", None
+        with self.lock:
+            job["files"][index].update(
+                state="done" if result else "failed",
+                output=result,
+                seconds=record["seconds"] if record else None,
+                messages=messages,
+            )
+            if result:
+                job["processed"] += 1
+            else:
+                job["failed"] += 1
+            self._finish(job)
+
+    def _finish(self, job):
+        # with the lock held
+        if job["processed"] + job["failed"] == job["total"] and not job["finished"]:
+            job["finished"] = time.time()
+            job["futures"] = []
+            job["event"].set()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished"]]
+        for job_id in finished[: max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[job_id]
+
+    def status(self, job_id, files=True):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["finished"]:
+                state = "done" if not job["failed"] else "failed"
+            elif job["processed"] + job["failed"] or any(
+                future.running() for future in job["futures"]
+            ):
+                state = "running"
+            else:
+                state = "queued"
+            status = {
+                key: value
+                for key, value in job.items()
+                if key not in ("futures", "event")
+            }
+            status["state"] = state
+            if files:
+                status["files"] = [dict(file) for file in job["files"]]
+            else:
+                del status["files"]
+            return status
+
+    def wait(self, job_id):
+        with self.lock:
+            event = self.jobs[job_id]["event"]
+        event.wait()
+        return self.status(job_id)
+
+    def overview(self):
+        with self.lock:
+            job_ids = list(self.jobs)
+        jobs = [self.status(job_id, files=False) for job_id in job_ids]
+        return {
+            "workers": self.workers,
+            "pending_files": sum(
+                job["total"] - job["processed"] - job["failed"] for job in jobs if job
+            ),
+            "jobs": [job for job in jobs if job],
+        }
+
+    def close(self):
+        # queued files are dropped, the ones being processed are finished
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+# every request needs the token written to the token file at start; requests
+# from web pages (with an Origin header) and POSTs that are not JSON, which a
+# browser could send cross-origin without asking, are refused
+class _Handler(BaseHTTPRequestHandler):
+    queue = None
+    token = None
+
+    def _reply(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _refused(self):
+        # replies and returns True when the request may not go on
+        if self.headers.get("Origin") is not None:
+            self._reply(403, {"error": "cross-origin requests are refused"})
+            return True
+        expected = f"Bearer {self.token}".encode()
+        given = self.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(given, expected):
+            self._reply(401, {"error": "missing or wrong token"})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._refused():
+            return
+        parts = self.path.strip("/").split("/")
+        if parts == ["status"] or parts == ["jobs"]:
+            return self._reply(200, self.queue.overview())
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            status = self.queue.status(int(parts[1]))
+            if status is not None:
+                return self._reply(200, status)
+        return self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self._refused():
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0]
+        if content_type.strip().lower() != "application/json":
+            return self._reply(415, {"error": "Content-Type must be application/json"})
+        if self.path.rstrip("/") != "/jobs":
+            return self._reply(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            status = self.queue.submit(request["path"], request.get("options", []))
+        except (ValueError, KeyError, TypeError) as error:
+            return self._reply(400, {"error": str(error)})
+        except RuntimeError as error:  # BrokenProcessPool too
+            return self._reply(
+                503,
+                {"error": f"the workers stopped ({error}); they were restarted"},
+            )
+        if request.get("wait"):  # reply when the job is finished
+            return self._reply(200, self.queue.wait(status["id"]))
+        return self._reply(202, status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, jobs=1, token=None):
+    # without token a new one is made; it is server.token
+    token = token or secrets.token_urlsafe(32)
+    queue = JobQueue(jobs)
+    handler = type("Handler", (_Handler,), {"queue": queue, "token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.token = token
+    return server, queue
+
+
+def write_token(path, token):
+    # created readable and writable by the user only
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="ascii") as file:
+        os.chmod(path, 0o600)  # the file may have existed with other modes
+        file.write(token + "\n")
+
+
+def build_serve_parser():
+    from sem_scale_bar.cli import _jobs_value
+
+    parser = argparse.ArgumentParser(
+        prog="sem_scale_bar.cli serve",
+        description=(
+            "Keep the engine loaded and process jobs sent over HTTP by "
+            "'sem_scale_bar.cli client'."
+        ),
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_jobs_value,
+        default="auto",
+        help="Worker processes shared by all jobs (default: auto)",
+    )
+    parser.add_argument(
+        "--token-file",
+        help=(
+            "Where to write the access token the clients send "
+            "(default: ~/.sem_scale_bar_server_<port>.token)"
+        ),
+    )
+    return parser
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve_main(argv=None):
+    from sem_scale_bar.batch import resolve_jobs
+    from sem_scale_bar.client import default_token_file
+
+    args = build_serve_parser().parse_args(argv)
+    server, queue = make_server(args.host, args.port, resolve_jobs(args.jobs))
+    token_file = args.token_file or default_token_file(server.server_address[1])
+    write_token(token_file, server.token)
+    # stop the same way on SIGTERM (service managers) as on Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+    print(
+        f"Serving on http://{args.host}:{server.server_address[1]} with "
+        f"{queue.workers} workers. Press Ctrl+C to stop."
+    )
+    print(f"Access token written to {token_file}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.close()
+        try:
+            os.remove(token_file)
+        except OSError:
+            pass
+    return 0
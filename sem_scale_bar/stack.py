@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import tifffile
+
+from sem_scale_bar.core import (
+    VENDOR_TAGS,
+    LazyTags,
+    _native_image,
+    cut_panel,
+    draw_bar,
+    parse_metadata,
+)
+from sem_scale_bar.encoders import tifffile_options
+
+
+def _slice_metadata(page, fallback):
+    # exports repeat the vendor tags on every slice or keep them on the first
+    metadata = parse_metadata(LazyTags(page.tags, VENDOR_TAGS))
+    if metadata.vendor is None and fallback is not None:
+        return fallback
+    return metadata
+
+
+# every page of a multi-page TIFF (FIB-SEM serial sections) into a multi-page
+# output, one slice in memory at a time; returns False for single-page files
+def process_stack(
+    full_file_name,
+    output_file,
+    lan,
+    rect_color,
+    corner,
+    label,
+    label_corner,
+    use_standard_sizes,
+    end_ticks=False,
+    lzw_compression=True,
+    grayscale=False,
+    encoder=None,
+    previews=(),
+):
+    render_args = (
+        lan,
+        rect_color,
+        corner,
+        label,
+        label_corner,
+        use_standard_sizes,
+        end_ticks,
+        grayscale,
+    )
+    with tifffile.TiffFile(full_file_name) as tif:
+        pages = tif.pages
+        pages.cache = False  # pages already read are not kept
+        count = len(pages)
+        if count < 2:
+            return False
+        first = pages.first
+        options = tifffile_options(lzw_compression, encoder)
+        channels = 1 if grayscale else 3
+        size = count * first.shape[0] * first.shape[1] * channels
+        # metadata and info panel height per slice geometry: they are parsed
+        # and searched once, and the overlay template is cached by draw_bar
+        geometries = {}
+        fallback = None
+        try:
+            with tifffile.TiffWriter(
+                output_file, bigtiff=size > 2**32 - 2**25
+            ) as writer:
+                for index in range(count):
+                    page = pages[index]
+                    if page.is_reduced:  # thumbnails are not slices
+                        continue
+                    img = _native_image(page.asarray())
+                    geometry = (img.shape, img.dtype)
+                    if geometry not in geometries:
+                        metadata = _slice_metadata(page, fallback)
+                        crop = cut_panel(img, metadata)
+                        geometries[geometry] = (metadata, img.shape[0] - crop.shape[0])
+                        fallback = fallback or metadata
+                    else:
+                        metadata, strip_height = geometries[geometry]
+                        crop = img[: img.shape[0] - strip_height]
+                    result = np.asarray(draw_bar(crop, metadata, *render_args))
+                    writer.write(
+                        result,
+                        photometric="minisblack" if grayscale else "rgb",
+                        **options,
+                    )
+                    if previews and index == 0:
+                        from sem_scale_bar.previews import write_previews
+
+                        write_previews(
+                            crop, metadata, previews, output_file, render_args
+                        )
+        except BaseException:
+            # no truncated stack is left behind
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+    return True
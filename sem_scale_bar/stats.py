@@ -0,0 +1,83 @@
+import json
+import math
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS
+
+
+def new_record(file_path):
+    return {
+        "path": file_path,
+        "output": None,
+        "ok": False,
+        "width": None,
+        "height": None,
+        "bytes_read": None,
+        "bytes_written": None,
+        "seconds": None,
+        "stages": {},
+        "peak_rss_delta_kb": None,
+    }
+
+
+def percentile(values, fraction):
+    # nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+# writes one JSON line per file and keeps the totals for the end-of-run summary
+class StatsRecorder:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self._start = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.latencies = []
+
+    def add(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.files += 1
+        if not record["ok"]:
+            self.failed += 1
+        self.bytes_read += record["bytes_read"] or 0
+        self.bytes_written += record["bytes_written"] or 0
+        if record["seconds"] is not None:
+            self.latencies.append(record["seconds"])
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        lines = [
+            f"{self.files} files ({self.failed} failed) in {elapsed:.2f} s: "
+            f"{self.files / elapsed:.2f} files/s, "
+            f"{self.bytes_read / elapsed / 2**20:.1f} MB/s read, "
+            f"{self.bytes_written / elapsed / 2**20:.1f} MB/s written"
+        ]
+        if self.latencies:
+            lines.append(
+                f"Latency per file: p50 {percentile(self.latencies, 0.5):.3f} s, "
+                f"p95 {percentile(self.latencies, 0.95):.3f} s, "
+                f"max {max(self.latencies):.3f} s"
+            )
+        lines.append(f"Per-file statistics written to {self.path}")
+        return "\n".join(lines)
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,126 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sem_scale_bar.discovery import is_output, walk_images
+
+
+def _scan(path, skip_dir=None, include=(), exclude=(), max_depth=None):
+    # yields (path, size, mtime) of the image files below path
+    for entry in walk_images(path, include, exclude, max_depth, skip_dir):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue  # removed or renamed while scanning
+        yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def _collect(future, file_path, journal, stats):
+    from sem_scale_bar.core import error_message
+
+    try:
+        _, result, messages, record = future.result()
+    except (Exception, KeyboardInterrupt):
+        result, messages, record = None, error_message(file_path) + "\n", None
+    print(f"Processing {file_path}...")
+    if messages:
+        print(messages, end="")
+    if record is not None:
+        stats.add(record)
+    if result and journal is not None:
+        journal.record(file_path, result)
+    return result
+
+
+def watch_folder(
+    path,
+    file_args,
+    file_kwargs=None,
+    output_dir=None,
+    jobs=1,
+    poll_interval=0.25,
+    journal=None,
+    stop=None,
+    stats=None,
+    include=(),
+    exclude=(),
+    max_depth=None,
+):
+    # processes the images that appear below path until interrupted or until
+    # stop (a threading.Event) is set; a file is picked up once its size and
+    # mtime are the same on two consecutive polls, so half-written files are
+    # left alone. Returns (processed, total).
+    from sem_scale_bar.batch import init_worker, run_job
+    from sem_scale_bar.core import build_output_path
+
+    file_kwargs = file_kwargs or {}
+    k = file_args[5]
+    skip_dir = os.path.abspath(output_dir) if output_dir else None
+    scan_options = (skip_dir, include, exclude, max_depth)
+    written = set()
+    done = {}
+    candidates = {}
+    running = {}
+    processed = 0
+    total = 0
+
+    # files present at start are treated as old unless the journal says otherwise
+    for file_path, size, mtime in _scan(path, *scan_options):
+        if journal is None or journal.is_done(file_path) or is_output(file_path, k):
+            done[file_path] = (size, mtime)
+
+    print(f"Watching {path} for new images. Press Ctrl+C to stop.")
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(True,)
+    ) as executor:
+        try:
+            while stop is None or not stop.is_set():
+                for future in [future for future in running if future.done()]:
+                    file_path, signature = running.pop(future)
+                    result = _collect(future, file_path, journal, stats)
+                    total += 1
+                    done[file_path] = signature
+                    if result:
+                        processed += 1
+                        written.add(os.path.abspath(result))
+
+                busy = {file_path for file_path, _ in running.values()}
+                seen = set()
+                for file_path, size, mtime in _scan(path, *scan_options):
+                    signature = (size, mtime)
+                    seen.add(file_path)
+                    if (
+                        done.get(file_path) == signature
+                        or file_path in busy
+                        or os.path.abspath(file_path) in written
+                        or is_output(file_path, k)
+                    ):
+                        continue
+                    if size and candidates.get(file_path) == signature:
+                        del candidates[file_path]
+                        job = (
+                            file_path,
+                            build_output_path(file_path, output_dir, path),
+                            file_args,
+                            file_kwargs,
+                            stats is not None,
+                        )
+                        running[executor.submit(run_job, job)] = (
+                            file_path,
+                            signature,
+                        )
+                    else:
+                        candidates[file_path] = signature
+                for file_path in list(candidates):
+                    if file_path not in seen:
+                        del candidates[file_path]
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for the files in progress...")
+        for future, (file_path, _) in running.items():
+            total += 1
+            if _collect(future, file_path, journal, stats):
+                processed += 1
+    if journal is not None:
+        journal.close()
+    return processed, total
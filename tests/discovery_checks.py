@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+
+from sem_scale_bar.discovery import is_output, iter_images
+
+SOURCE = "./images for test/Zeiss_1.tif"
+
+# relative path -> None for a copy of SOURCE, or the bytes of the file
+TREE = {
+    "a.tif": None,
+    "a_cut_1.tif": None,
+    "a_cut_1_256.tif": None,
+    "cross_cut_2.tif": None,
+    "notes.txt": b"notes",
+    "fake.tif": b"a sidecar",
+    "empty.png": b"",
+    "sub/b.tif": None,
+    "sub/deep/c.tif": None,
+    "thumbnails/t.tif": None,
+    "output/a.tif": None,
+}
+
+
+def make_tree(root):
+    for relative_path, data in TREE.items():
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if data is None:
+            shutil.copy2(SOURCE, path)
+        else:
+            with open(path, "wb") as file:
+                file.write(data)
+    os.symlink("..", os.path.join(root, "sub", "loop"))
+
+
+def found(root, **options):
+    return sorted(
+        os.path.relpath(path, root).replace(os.sep, "/")
+        for path in iter_images(root, **options)
+    )
+
+
+def check_discovery(root):
+    images = ["a.tif", "cross_cut_2.tif", "sub/b.tif", "sub/deep/c.tif"]
+    images += ["thumbnails/t.tif", "output/a.tif"]
+    outputs = ["a_cut_1.tif", "a_cut_1_256.tif"]
+
+    # sidecars, empty files and links to folders are left out
+    assert found(root) == sorted(images + outputs)
+    # outputs of the given index only
+    assert found(root, k=1) == sorted(images)
+    assert found(root, k=2) == sorted(set(images + outputs) - {"cross_cut_2.tif"})
+    assert is_output("x_cut_1_1024.jpg", 1) and not is_output("x_cut_10.tif", 1)
+
+    assert found(root, k=1, skip_dir=os.path.join(root, "output")) == sorted(
+        set(images) - {"output/a.tif"}
+    )
+    assert found(root, k=1, max_depth=0) == ["a.tif", "cross_cut_2.tif"]
+    assert found(root, k=1, max_depth=1) == sorted(
+        set(images) - {"sub/deep/c.tif"}
+    )
+    assert found(root, k=1, include=["*_cut_*"]) == ["cross_cut_2.tif"]
+    assert found(root, k=1, include=["sub/*"]) == ["sub/b.tif", "sub/deep/c.tif"]
+    assert found(root, k=1, exclude=["thumbnails", "output", "deep"]) == [
+        "a.tif",
+        "cross_cut_2.tif",
+        "sub/b.tif",
+    ]
+    assert found(root, k=1, exclude=["sub/deep"]) == sorted(
+        set(images) - {"sub/deep/c.tif"}
+    )
+
+    # a file is passed through, whatever it is
+    fake = os.path.join(root, "fake.tif")
+    assert list(iter_images(fake)) == [fake]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root)
+        check_discovery(root)
+    print("discovery checks passed")
+
+
+if __name__ == "__main__":
+    main()
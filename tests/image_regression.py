@@ -1,13 +1,16 @@
 import argparse
+import io
 import os
 import shutil
 import tempfile
 
 import numpy as np
+import tifffile
 from PIL import Image
 
 from sem_scale_bar.cli import process_path
-from sem_scale_bar.core import build_output_path, process_file
+from sem_scale_bar.core import build_output_path, process_bytes, process_file
+from sem_scale_bar.encoders import get_encoder
 
 TEST_CASES = [
     {
@@ -157,6 +160,141 @@ TEST_CASES = [
         "output_mode": "output_index",
         "output_index": 3,
     },
+    # the cases below give the same pixels as a case above through another
+    # path of the engine; they reuse its reference and do not generate it
+    {
+        "source": "./images for test/Zeiss_2.tif",
+        "options": {
+            "lzw": True,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+            "jobs": 2,
+        },
+        "reference": "./images for test/reference/output_dir/Zeiss_2.tif",
+        "output_mode": "output_dir",
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_2.tif",
+        "options": {
+            "lzw": True,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+            "pipeline": True,
+        },
+        "reference": "./images for test/reference/output_dir/Zeiss_2.tif",
+        "output_mode": "output_dir",
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_3.tif",
+        "options": {
+            "lzw": False,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+            "label": "III)",
+            "label-corner": "right",
+        },
+        "kwargs": {"large_image": True},
+        "reference": (
+            "./images for test/reference/White_English_Right_Label_III)_Right.tif"
+        ),
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_2.tif",
+        "options": {
+            "lzw": False,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "left",
+            "label": "b)",
+            "label-corner": "right",
+        },
+        "kwargs": {"grayscale": True},
+        "reference": (
+            "./images for test/reference/White_English_Left_Label_b)_Right.tif"
+        ),
+        "reference_band": 0,
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_3.tif",
+        "options": {
+            "lzw": False,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+            "label": "III)",
+            "label-corner": "right",
+        },
+        "kwargs": {"encoder": get_encoder("deflate")},
+        "reference": (
+            "./images for test/reference/White_English_Right_Label_III)_Right.tif"
+        ),
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_2.tif",
+        "options": {
+            "lzw": False,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "left",
+            "label": "b)",
+            "label-corner": "right",
+        },
+        "reference": (
+            "./images for test/reference/White_English_Left_Label_b)_Right.tif"
+        ),
+        "output_mode": "stack",
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_1.tif",
+        "options": {
+            "lzw": True,
+            "language": "English",
+            "background-color": "transparent",
+            "scale-bar-corner": "left",
+            "standard-sizes": True,
+        },
+        "reference": (
+            "./images for test/reference/"
+            "Transparent_English_Left_NoLabel_StandardSizes.tif"
+        ),
+        "output_mode": "bytes",
+        "variant": True,
+    },
+    # float32 and 16-bit copies of a fixture, rendered by process_bytes and
+    # compared with process_file on the same copy instead of a reference
+    {
+        "source": "./images for test/Tescan_1.TIF",
+        "options": {
+            "lzw": False,
+            "language": "Russian",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+        },
+        "output_mode": "bytes",
+        "source_dtype": "float32",
+        "variant": True,
+    },
+    {
+        "source": "./images for test/Zeiss_1.tif",
+        "options": {
+            "lzw": True,
+            "language": "English",
+            "background-color": "white",
+            "scale-bar-corner": "right",
+        },
+        "output_mode": "bytes",
+        "source_dtype": "uint16",
+        "variant": True,
+    },
 ]
 
 
@@ -165,9 +303,7 @@ def load_image(path):
         return np.asarray(image)
 
 
-def compare_images(generated_path, reference_path):
-    generated = load_image(generated_path)
-    reference = load_image(reference_path)
+def compare_arrays(generated, reference):
     if generated.shape != reference.shape:
         raise AssertionError(
             "Image shape mismatch: "
@@ -177,6 +313,14 @@ def compare_images(generated_path, reference_path):
         raise AssertionError("Image pixels differ from reference.")
 
 
+def compare_images(generated_path, reference_path, band=None):
+    # band: compare with one channel of the reference, for grayscale outputs
+    reference = load_image(reference_path)
+    if band is not None:
+        reference = reference[..., band]
+    compare_arrays(load_image(generated_path), reference)
+
+
 def process_case_direct(case, output_path):
     options = case["options"]
     process_file(
@@ -191,6 +335,7 @@ def process_case_direct(case, output_path):
         options.get("end-ticks", False),
         lzw_compression=options.get("lzw", True),
         output_path=output_path,
+        **case.get("kwargs", {}),
     )
 
 
@@ -208,6 +353,9 @@ def process_case_output_dir(case, output_dir):
         options.get("end-ticks", False),
         options.get("lzw", True),
         output_dir=output_dir,
+        jobs=options.get("jobs", 1),
+        pipeline=options.get("pipeline", False),
+        **case.get("kwargs", {}),
     )
 
 
@@ -238,8 +386,81 @@ def process_case_output_index(case, work_dir):
     return os.path.join(work_dir, output_name)
 
 
+def write_stack(source, stack_path, pages=2):
+    # a multi-page TIFF with the frame and the CZ_SEM tag of source on every page
+    with tifffile.TiffFile(source) as tif:
+        page = tif.pages[0]
+        frame = page.asarray()
+        tag = page.tags["CZ_SEM"]
+        tif.filehandle.seek(tag.valueoffset)
+        extratag = (tag.code, "s", 0, tif.filehandle.read(tag.count), True)
+    with tifffile.TiffWriter(stack_path) as writer:
+        for _ in range(pages):
+            writer.write(frame, extratags=[extratag])
+
+
+def write_converted(source, converted_path, dtype):
+    # source with its frame scaled to the full range of dtype (up to 65535,
+    # so float frames go through the /255 step) and the same vendor tags
+    with tifffile.TiffFile(source) as tif:
+        page = tif.pages[0]
+        frame = page.asarray()
+        extratags = []
+        for name in ("CZ_SEM", "50431"):
+            tag = page.tags.get(name)
+            if tag is None:
+                continue
+            tif.filehandle.seek(tag.valueoffset)
+            data = tif.filehandle.read(tag.valuebytecount)
+            if tag.dtype == 2:  # ASCII
+                extratags.append((tag.code, "s", 0, data, True))
+            else:
+                extratags.append((tag.code, tag.dtype, None, data, True))
+    tifffile.imwrite(converted_path, frame.astype(dtype) * 257, extratags=extratags)
+
+
+def process_case_stack(case, work_dir):
+    # returns the pages of the output stack
+    stack_path = os.path.join(work_dir, os.path.basename(case["source"]))
+    write_stack(case["source"], stack_path)
+    output_path = os.path.join(work_dir, "output.tif")
+    case = dict(case, kwargs=dict(case.get("kwargs", {}), stack=True))
+    process_case_direct(dict(case, source=stack_path), output_path)
+    with tifffile.TiffFile(output_path) as tif:
+        return [page.asarray() for page in tif.pages]
+
+
+def process_case_bytes(case):
+    options = case["options"]
+    with open(case["source"], "rb") as file:
+        data = process_bytes(
+            file.read(),
+            options.get("language", "English"),
+            options.get("background-color", "white"),
+            options.get("scale-bar-corner", "right"),
+            options.get("label", ""),
+            options.get("label-corner", "left"),
+            options.get("standard-sizes", False),
+            options.get("end-ticks", False),
+            lzw_compression=options.get("lzw", True),
+        )
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image)
+
+
+def compare_bytes_with_file(case, work_dir):
+    converted = os.path.join(work_dir, os.path.basename(case["source"]))
+    write_converted(case["source"], converted, case["source_dtype"])
+    case = dict(case, source=converted)
+    generated = os.path.join(work_dir, "output.tif")
+    process_case_direct(case, generated)
+    compare_arrays(process_case_bytes(case), load_image(generated))
+
+
 def generate_references():
     for case in TEST_CASES:
+        if case.get("variant"):
+            continue
         if not os.path.exists(case["source"]):
             raise FileNotFoundError(f"Missing source image: {case['source']}")
         reference = case["reference"]
@@ -259,6 +480,10 @@ def verify_references():
     for case in TEST_CASES:
         if not os.path.exists(case["source"]):
             raise FileNotFoundError(f"Missing source image: {case['source']}")
+        if "source_dtype" in case:
+            with tempfile.TemporaryDirectory() as work_dir:
+                compare_bytes_with_file(case, work_dir)
+            continue
         reference = case["reference"]
         if not os.path.exists(reference):
             print(
@@ -273,7 +498,16 @@ def verify_references():
                 generated = build_output_path(
                     case["source"], output_dir, os.path.dirname(case["source"])
                 )
-                compare_images(generated, reference)
+                compare_images(generated, reference, case.get("reference_band"))
+        elif output_mode == "stack":
+            with tempfile.TemporaryDirectory() as work_dir:
+                pages = process_case_stack(case, work_dir)
+                if len(pages) != 2:
+                    raise AssertionError(f"Expected 2 pages, got {len(pages)}.")
+                for page in pages:
+                    compare_arrays(page, load_image(reference))
+        elif output_mode == "bytes":
+            compare_arrays(process_case_bytes(case), load_image(reference))
         elif output_mode == "output_index":
             with tempfile.TemporaryDirectory() as work_dir:
                 generated = process_case_output_index(case, work_dir)
@@ -285,7 +519,7 @@ def verify_references():
                 )
                 process_case_direct(case, generated)
                 try:
-                  compare_images(generated, reference)
+                  compare_images(generated, reference, case.get("reference_band"))
                 except Exception as e:
                   print(case)
                   raise e
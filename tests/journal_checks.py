@@ -0,0 +1,92 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+from sem_scale_bar.cli import process_path
+from sem_scale_bar.journal import JOURNAL_NAME, load_entries
+
+SOURCES = ["./images for test/Zeiss_1.tif", "./images for test/Zeiss_2.tif"]
+
+
+def run(input_dir, output_dir, language="English", resume=True, force=False):
+    # returns the files processed and the files skipped by the journal
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        process_path(
+            input_dir,
+            language,
+            "white",
+            "right",
+            "",
+            "left",
+            1,
+            False,
+            False,
+            True,
+            output_dir=output_dir,
+            resume=resume,
+            force=force,
+        )
+    lines = messages.getvalue().splitlines()
+    processed = sorted(
+        os.path.basename(line[len("Processing ") : -3])
+        for line in lines
+        if line.startswith("Processing ")
+    )
+    skipped = sorted(
+        os.path.basename(line[len("Skipping ") :].split(",")[0])
+        for line in lines
+        if line.startswith("Skipping ")
+    )
+    return processed, skipped
+
+
+def check_journal(work_dir):
+    input_dir = os.path.join(work_dir, "input")
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(input_dir)
+    for source in SOURCES:
+        shutil.copy2(source, input_dir)
+    names = sorted(os.path.basename(source) for source in SOURCES)
+    journal_path = os.path.join(output_dir, JOURNAL_NAME)
+
+    assert run(input_dir, output_dir) == (names, [])
+    assert len(load_entries(journal_path)) == 2
+
+    # a second run skips everything
+    assert run(input_dir, output_dir) == ([], names)
+
+    # a changed input is processed again
+    changed = os.path.join(input_dir, names[0])
+    stat = os.stat(changed)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run(input_dir, output_dir) == ([names[0]], [names[1]])
+
+    # a missing output is written again
+    os.remove(os.path.join(output_dir, names[1]))
+    assert run(input_dir, output_dir) == ([names[1]], [names[0]])
+
+    # other options do not match the recorded ones
+    assert run(input_dir, output_dir, language="Russian") == (names, [])
+
+    # --force processes everything and refreshes the journal
+    assert run(input_dir, output_dir, force=True) == (names, [])
+    assert run(input_dir, output_dir) == ([], names)
+
+    # a line cut short by a crash is ignored
+    with open(journal_path, "a", encoding="utf-8") as file:
+        file.write('{"input": "/cut/sh')
+    assert len(load_entries(journal_path)) == 2
+    assert run(input_dir, output_dir) == ([], names)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        check_journal(work_dir)
+    print("journal checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import time
+
+from sem_scale_bar.large_image import TILE_SIZE
+from sem_scale_bar.scheduler import (
+    BASE_MEMORY,
+    TILE_ROW_BYTES,
+    estimate_memory,
+    imap_budgeted,
+    parse_size,
+)
+
+SIZES = {
+    "512M": 512 * 2**20,
+    "512m": 512 * 2**20,
+    "2.5GB": int(2.5 * 2**30),
+    "16g": 16 * 2**30,
+    "1k": 1024,
+    "1000": 1000,
+    " 8G ": 8 * 2**30,
+}
+BAD_SIZES = ["", "G", "abc", "-1G", "0", "12X", "inf", "nan", "1e400", "-inf"]
+
+
+def check_parse_size():
+    for text, size in SIZES.items():
+        assert parse_size(text) == size, text
+    for text in BAD_SIZES:
+        try:
+            parse_size(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"{text!r} was accepted")
+
+
+def check_estimate_memory():
+    source = "./images for test/Zeiss_1.tif"  # 1024x768, 8-bit, uncompressed
+    rgb = estimate_memory(source)
+    grayscale = estimate_memory(source, grayscale=True)
+    large = estimate_memory(source, large_image=True)
+    assert rgb > grayscale > BASE_MEMORY
+    assert rgb - grayscale == 1024 * 768 * 2
+    # one row of tiles at a time, whatever the height
+    assert large == BASE_MEMORY + 1024 * TILE_SIZE * TILE_ROW_BYTES
+    assert estimate_memory("./images for test/notes.txt") == 0
+
+
+def sleep_job(item):
+    # returns (item, start, end); the sleep stands for the work
+    start = time.monotonic()
+    time.sleep(0.05)
+    return item, start, time.monotonic()
+
+
+def check_imap_budgeted():
+    estimates = [10, 50, 30, 90, 20, 200, 40, 60, 10, 70]
+    budget = 100
+    items = list(range(len(estimates)))
+    results = list(imap_budgeted(sleep_job, items, estimates, 4, budget))
+
+    # results come back in the order of items
+    assert [item for item, _, _ in results] == items
+
+    # the largest item starts first, and runs alone as it is over budget
+    starts = sorted(results, key=lambda result: result[1])
+    assert starts[0][0] == 5
+    assert all(start >= starts[0][2] for _, start, _ in starts[1:])
+
+    # the estimates of the items running together never exceed the budget
+    events = sorted(
+        [(start, 1, item) for item, start, _ in results]
+        + [(end, -1, item) for item, _, end in results]
+    )
+    in_use = 0
+    for _, step, item in events:
+        in_use += step * estimates[item]
+        if step == 1 and estimates[item] <= budget:
+            assert in_use <= budget, in_use
+
+    assert list(imap_budgeted(sleep_job, [], [], 2, budget)) == []
+
+
+def main():
+    check_parse_size()
+    check_estimate_memory()
+    check_imap_budgeted()
+    print("scheduler checks passed")
+
+
+if __name__ == "__main__":
+    main()
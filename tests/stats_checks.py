@@ -0,0 +1,23 @@
+from sem_scale_bar.stats import percentile
+
+
+def check_percentile():
+    hundred = list(range(1, 101))
+    assert percentile(hundred, 0.5) == 50
+    assert percentile(hundred, 0.95) == 95
+    assert percentile(hundred, 1.0) == 100
+    twenty = list(range(20, 0, -1))  # unsorted on purpose
+    assert percentile(twenty, 0.5) == 10
+    assert percentile(twenty, 0.95) == 19
+    assert percentile(twenty, 0.0) == 1
+    assert percentile([7], 0.95) == 7
+    assert percentile([], 0.5) is None
+
+
+def main():
+    check_percentile()
+    print("stats checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+SOURCE = "./images for test/Zeiss_1.tif"
+
+
+def write_large(path, factor=12):
+    # Zeiss_1 enlarged factor times, with its CZ_SEM tag: a few seconds of work
+    with tifffile.TiffFile(SOURCE) as tif:
+        page = tif.pages[0]
+        frame = page.asarray()
+        tag = page.tags["CZ_SEM"]
+        tif.filehandle.seek(tag.valueoffset)
+        extratag = (tag.code, "s", 0, tif.filehandle.read(tag.count), True)
+    large = np.kron(frame, np.ones((factor, factor), frame.dtype))
+    tifffile.imwrite(path, large, extratags=[extratag])
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+def check_ctrl_c_finishes_files(work_dir):
+    # Ctrl+C reaches the workers too; the file in progress must still finish
+    input_dir = os.path.join(work_dir, "input")
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(input_dir)
+    log_path = os.path.join(work_dir, "log.txt")
+    with open(log_path, "w") as log:
+        watcher = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "sem_scale_bar.cli",
+                input_dir,
+                "--watch",
+                "--output-dir",
+                output_dir,
+                "--poll-interval",
+                "0.1",
+            ],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,  # its own process group, as in a terminal
+        )
+    try:
+        wait_for(lambda: "Watching" in open(log_path).read())
+        staging = os.path.join(work_dir, "large.tif")
+        write_large(staging)
+        started = time.monotonic()
+        os.replace(staging, os.path.join(input_dir, "large.tif"))
+        time.sleep(1.0)  # picked up after two polls, then a few seconds of work
+        os.killpg(watcher.pid, signal.SIGINT)
+        watcher.wait(timeout=120)
+        elapsed = time.monotonic() - started
+    finally:
+        if watcher.poll() is None:
+            watcher.kill()
+    log = open(log_path).read()
+    assert "Stopping, waiting for the files in progress" in log, log
+    assert "1 of 1 files processed" in log, log
+    assert "Error" not in log, log
+    assert elapsed > 1.5, "the file was finished before Ctrl+C, retry"
+    with tifffile.TiffFile(os.path.join(output_dir, "large.tif")) as tif:
+        assert tif.pages[0].shape[2] == 3
+
+
+def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        check_ctrl_c_finishes_files(work_dir)
+    print("watch checks passed")
+
+
+if __name__ == "__main__":
+    main()